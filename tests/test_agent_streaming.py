@@ -0,0 +1,71 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("PySide6")
+from PySide6.QtCore import QCoreApplication
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from text_editor import AgentRequest, FakeLocalBackend, FakeLocalServer, OllamaBackend
+
+
+@pytest.fixture(scope="module")
+def app():
+    return QCoreApplication.instance() or QCoreApplication([])
+
+
+async def _collect(prompt, delay=0):
+    server = FakeLocalServer(delay=delay)
+    await server.start()
+    try:
+        return [token async for token in OllamaBackend("127.0.0.1", server.port).stream(prompt)]
+    finally:
+        await server.close()
+
+
+def test_ollama_backend_streams_chunked_reply():
+    prompt = "Summarize this\n\n--- Text before the cursor ---\nhello"
+    tokens = asyncio.run(_collect(prompt))
+    # One chunk per word, reassembled into the canned reply
+    assert len(tokens) > 1
+    assert "".join(tokens) == FakeLocalServer.reply_for(prompt)
+
+
+def test_request_reports_tokens_and_success(app):
+    request = AgentRequest(FakeLocalBackend(), "Say something")
+    tokens, results = [], []
+    request.token.connect(tokens.append)
+    request.finished.connect(results.append)
+    request._run()  # on this thread, so the signals are delivered directly
+    assert "".join(tokens) == FakeLocalServer.reply_for("Say something")
+    assert results == [""]
+
+
+def test_request_cancelled_before_start_is_stopped(app):
+    request = AgentRequest(FakeLocalBackend(), "Say something")
+    tokens, results = [], []
+    request.token.connect(tokens.append)
+    request.finished.connect(results.append)
+    request.cancel()
+    request._run()
+    assert tokens == []
+    assert results == ["Stopped"]
+
+
+def test_request_cancelled_while_streaming_is_stopped(app):
+    request = AgentRequest(FakeLocalBackend(), "Please write a few words of reply")
+    tokens, results = [], []
+
+    def on_token(token):
+        tokens.append(token)
+        request.cancel()
+
+    request.token.connect(on_token)
+    request.finished.connect(results.append)
+    request._run()
+    assert len(tokens) == 1
+    assert results == ["Stopped"]
+    # Cancelling again once the loop has closed is harmless
+    request.cancel()
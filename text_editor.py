@@ -1,14 +1,32 @@
 import sys
 import re
 import os
+import json
+import asyncio
+import math
+import bisect
+import time
+import zlib
+import tempfile
+import struct
+import mmap
+import queue
+import hashlib
+import itertools
+import threading
+import abc
+from array import array
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QPlainTextEdit, QFileDialog, QMessageBox, QToolBar,
     QToolButton, QMenu, QWidget, QLabel, QStatusBar, QInputDialog, QLineEdit,
-    QHBoxLayout, QPushButton, QVBoxLayout
+    QHBoxLayout, QPushButton, QVBoxLayout, QProgressDialog, QAbstractScrollArea,
+    QComboBox, QDockWidget
 )
-from PySide6.QtGui import QAction, QKeySequence, QIcon, QPainter, QColor, QFont, QTextFormat, QPalette, QTextCursor, QPixmap
+from PySide6.QtGui import QAction, QKeySequence, QIcon, QPainter, QColor, QFont, QTextFormat, QPalette, QTextCursor, QPixmap, QTextDocument, QTextCharFormat
 from PySide6.QtSvg import QSvgRenderer
-from PySide6.QtCore import Qt, QRect, QSize
+from PySide6.QtCore import Qt, QRect, QSize, QObject, Signal, QTimer, QByteArray
 from PySide6.QtWidgets import QSizePolicy
 from PySide6.QtWidgets import QApplication, QStyle, QTextEdit
 
@@ -132,6 +150,1829 @@ class SearchWidget(QWidget):
         self.search_input.selectAll()
 
 
+# Per-user cache for the spelling index and the saved session
+APP_CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "ps_text_editor")
+
+
+# Undo history limits
+UNDO_MEMORY_BUDGET = 32 * 1024 * 1024   # bytes of undo text kept in memory
+UNDO_DISK_BUDGET = 256 * 1024 * 1024    # bytes spilled to disk before the oldest entries are dropped
+UNDO_KEEP_RAW = 32                      # newest entries kept uncompressed, unless they are large
+UNDO_COMPRESS_MIN = 4096                # entries smaller than this are not worth compressing
+UNDO_COALESCE_SECONDS = 1.0             # typing pauses longer than this start a new entry
+
+
+def _format_bytes(size):
+    """Return a short human readable size such as '1.2 MB'."""
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+# Qt positions count UTF-16 units; characters outside the BMP take two
+_ASTRAL_RE = re.compile("[\U00010000-\U0010FFFF]")
+_PARAGRAPH_SPLIT_RE = re.compile("\r\n|[\r\n\u2029]")
+
+
+def _utf16_len(text):
+    """Return the length of text in UTF-16 units, as Qt counts positions."""
+    return len(text) + len(_ASTRAL_RE.findall(text))
+
+
+def _utf16_index(text, offset):
+    """Return the index into text of the UTF-16 position `offset`."""
+    if not _ASTRAL_RE.search(text, 0, offset):
+        return offset
+    index = units = 0
+    while units < offset:
+        units += 2 if ord(text[index]) > 0xFFFF else 1
+        index += 1
+    return index
+
+
+class UndoEntry:
+    """A single reversible change: `removed` at `position` was replaced by `added`.
+
+    The text is kept raw while the entry is recent, then compressed with zlib
+    and finally spilled to the history's temporary file.
+    """
+
+    __slots__ = ("position", "typing", "timestamp", "_removed", "_added", "_packed", "_split", "_spill")
+
+    def __init__(self, position, removed, added, typing=False):
+        self.position = position
+        self.typing = typing
+        self.timestamp = time.monotonic()
+        self._removed = removed
+        self._added = added
+        self._packed = None   # zlib-compressed utf-8 of removed + added
+        self._split = 0       # byte length of the removed part inside the packed data
+        self._spill = None    # (offset, length) inside the spill file
+
+    def is_raw(self):
+        return self._removed is not None
+
+    def is_spilled(self):
+        return self._spill is not None
+
+    def memory_size(self):
+        if self._spill is not None:
+            return 0
+        if self._packed is not None:
+            return sys.getsizeof(self._packed)
+        return sys.getsizeof(self._removed) + sys.getsizeof(self._added)
+
+    def disk_size(self):
+        return self._spill[1] if self._spill is not None else 0
+
+    def text_size(self):
+        """Return the raw number of characters recorded (0 once packed)."""
+        if self._removed is None:
+            return 0
+        return len(self._removed) + len(self._added)
+
+    def coalesce(self, position, removed, added):
+        """Try to merge a small follow-up change into this entry. Return True on success."""
+        if self._removed is None:
+            return False
+        end = self.position + _utf16_len(self._added)
+        if added and not removed:
+            # Typing continues at the end of what was typed so far, until a line break
+            if position != end or self._added.endswith("\u2029"):
+                return False
+            self._added += added
+        elif removed and not added:
+            if self._added:
+                # Backspacing over characters typed in this same entry
+                if position + _utf16_len(removed) != end or not self._added.endswith(removed):
+                    return False
+                self._added = self._added[:-len(removed)]
+            elif position + _utf16_len(removed) == self.position:
+                # Backspace
+                self.position = position
+                self._removed = removed + self._removed
+            elif position == self.position:
+                # Delete
+                self._removed += removed
+            else:
+                return False
+        else:
+            return False
+        self.timestamp = time.monotonic()
+        return True
+
+    def extend(self, position, removed, added):
+        """Append an insertion made right after this entry's text (grouped edits)."""
+        if self._removed is None or removed or position != self.position + _utf16_len(self._added):
+            return False
+        self._added += added
+        return True
+
+    def compress(self):
+        if self._removed is None:
+            return
+        removed = self._removed.encode("utf-8", "surrogatepass")
+        added = self._added.encode("utf-8", "surrogatepass")
+        self._split = len(removed)
+        self._packed = zlib.compress(removed + added, 1)
+        self._removed = self._added = None
+
+    def spill(self, spill_file):
+        self.compress()
+        spill_file.seek(0, os.SEEK_END)
+        offset = spill_file.tell()
+        spill_file.write(self._packed)
+        self._spill = (offset, len(self._packed))
+        self._packed = None
+
+    def move_spill(self, old_file, new_file):
+        """Copy spilled data into `new_file` (used when compacting the spill file)."""
+        if self._spill is None:
+            return
+        offset, length = self._spill
+        old_file.seek(offset)
+        data = old_file.read(length)
+        new_file.seek(0, os.SEEK_END)
+        self._spill = (new_file.tell(), length)
+        new_file.write(data)
+
+    def texts(self, spill_file):
+        """Return (removed, added), reading back compressed or spilled storage if needed."""
+        if self._removed is not None:
+            return self._removed, self._added
+        if self._spill is not None:
+            offset, length = self._spill
+            spill_file.seek(offset)
+            packed = spill_file.read(length)
+        else:
+            packed = self._packed
+        data = zlib.decompress(packed)
+        return (data[:self._split].decode("utf-8", "surrogatepass"),
+                data[self._split:].decode("utf-8", "surrogatepass"))
+
+
+class UndoHistory(QObject):
+    """Memory-bounded undo/redo history for a QPlainTextEdit.
+
+    Replaces the document's own (unbounded) undo stack. Changes are read from
+    `contentsChange` against a per-block shadow of the text (only the blocks an
+    edit touches are looked at and replaced), consecutive typing is
+    coalesced into one entry, and once `memory_budget` is exceeded older entries
+    are compressed and then spilled to a temporary file.
+    """
+
+    undoAvailable = Signal(bool)
+    redoAvailable = Signal(bool)
+    usageChanged = Signal(int, int)  # bytes in memory, bytes spilled to disk
+
+    def __init__(self, editor, memory_budget=UNDO_MEMORY_BUDGET, disk_budget=UNDO_DISK_BUDGET):
+        super().__init__(editor)
+        self._editor = editor
+        self._document = editor.document()
+        self._document.setUndoRedoEnabled(False)
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        self._undo = []
+        self._redo = []
+        self._memory = 0
+        self._disk = 0
+        self._spill_file = None
+        self._blocks = [""]   # shadow copy of each block's text
+        self._length = 0      # document length in UTF-16 units, without the final separator
+        self._replaying = False
+        self._suspended = 0
+        self._grouping = False
+        self._group_entry = None
+        self._document.contentsChange.connect(self._on_contents_change)
+        self.reset()
+
+    # --- Public API ---
+    def can_undo(self):
+        return bool(self._undo)
+
+    def can_redo(self):
+        return bool(self._redo)
+
+    def memory_usage(self):
+        return self._memory
+
+    def disk_usage(self):
+        return self._disk
+
+    def set_memory_budget(self, budget):
+        self.memory_budget = budget
+        self._enforce_budget()
+        self._emit_state()
+
+    def reset(self, text=None):
+        """Forget all history and resynchronize with the document text.
+
+        Passing the text just given to setPlainText() saves reading it back.
+        """
+        self._undo = []
+        self._redo = []
+        self._memory = 0
+        self._disk = 0
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+        self._blocks = self._snapshot(text)
+        self._length = self._document.characterCount() - 1
+        self._emit_state()
+
+    def begin_group(self):
+        """Merge consecutive insertions into one entry until end_group() (e.g. streamed text)."""
+        self._grouping = True
+        self._group_entry = None
+
+    def end_group(self):
+        self._grouping = False
+        self._group_entry = None
+        # The finished group may be large; it is no longer exempt from the budget
+        self._enforce_budget()
+        self._emit_state()
+
+    def discard_group(self):
+        """End the group, revert its changes and forget them (e.g. a cancelled paste)."""
+        entry = self._group_entry
+        self.end_group()
+        if entry is None or not self._undo or self._undo[-1] is not entry:
+            return
+        self.undo()
+        self._redo.pop()
+        self._memory -= entry.memory_size()
+        self._disk -= entry.disk_size()
+        self._emit_state()
+
+    def suspend(self):
+        """Ignore document changes until resume(); call reset() afterwards."""
+        self._suspended += 1
+
+    def resume(self):
+        self._suspended -= 1
+
+    @contextmanager
+    def suspended(self):
+        """Ignore document changes (e.g. loading a file); call reset() afterwards."""
+        self.suspend()
+        try:
+            yield
+        finally:
+            self.resume()
+
+    def undo(self):
+        if not self._undo:
+            return
+        entry = self._undo.pop()
+        removed, added = entry.texts(self._spill_file)
+        self._apply(entry.position, _utf16_len(added), removed)
+        self._redo.append(entry)
+        self._emit_state()
+
+    def redo(self):
+        if not self._redo:
+            return
+        entry = self._redo.pop()
+        removed, added = entry.texts(self._spill_file)
+        self._apply(entry.position, _utf16_len(removed), added)
+        self._undo.append(entry)
+        self._emit_state()
+
+    # --- Recording ---
+    def _snapshot(self, text=None):
+        """Return the text of every block, split at C speed rather than block by block."""
+        count = self._document.blockCount()
+        if text is not None:
+            blocks = _PARAGRAPH_SPLIT_RE.split(text)
+            if len(blocks) == count:
+                return blocks
+        blocks = self._document.toRawText().split("\u2029")
+        if len(blocks) == count + 1 and not blocks[-1]:
+            blocks.pop()
+        if len(blocks) == count:
+            return blocks
+        blocks = []
+        block = self._document.begin()
+        while block.isValid():
+            blocks.append(block.text())
+            block = block.next()
+        return blocks
+
+    def _on_contents_change(self, position, removed, added):
+        if self._suspended:
+            return
+        doc_len = self._document.characterCount() - 1
+        # Qt may report one character too many around the final paragraph separator
+        removed = min(removed, self._length - position)
+        added = min(added, doc_len - position)
+        change = None
+        if position >= 0 and removed >= 0 and added >= 0 and self._length - removed + added == doc_len:
+            change = self._splice(position, removed, added)
+        if change is None:
+            # Merged edit blocks can report an inconsistent range; diff the blocks instead
+            change = self._diff_with_document()
+        self._length = doc_len
+        position, removed_text, added_text = change
+
+        if self._replaying or removed_text == added_text:
+            return
+        self._record(position, removed_text, added_text)
+
+    def _splice(self, position, removed, added):
+        """Update the shadow blocks an edit touched; return (position, removed, added) texts.
+
+        Everything before `position` is unchanged, so the block containing it
+        has the same number and start before and after the edit.
+        """
+        block = self._document.findBlock(position)
+        first = block.blockNumber()
+        offset = position - block.position()
+        blocks = self._blocks
+        # Old blocks covered by the removed range, each followed by a separator
+        last = first
+        covered = _utf16_len(blocks[first])
+        while covered < offset + removed:
+            last += 1
+            if last >= len(blocks):
+                return None
+            covered += 1 + _utf16_len(blocks[last])
+        new_last = self._document.findBlock(position + added).blockNumber()
+        texts = []
+        while block.isValid() and block.blockNumber() <= new_last:
+            texts.append(block.text())
+            block = block.next()
+        old = "\u2029".join(blocks[first:last + 1])
+        new = "\u2029".join(texts)
+        start = _utf16_index(old, offset)
+        removed_text = old[start:start + _utf16_index(old[start:], removed)]
+        added_text = new[start:start + _utf16_index(new[start:], added)]
+        if old[:start] + added_text + old[start + len(removed_text):] != new:
+            return None
+        blocks[first:last + 1] = texts
+        return position, removed_text, added_text
+
+    def _diff_with_document(self):
+        """Return (position, removed, added) by comparing the shadow blocks with the document."""
+        old = self._blocks
+        new = self._snapshot()
+        limit = min(len(old), len(new))
+        start = 0
+        while start < limit and old[start] == new[start]:
+            start += 1
+        end = 0
+        while end < limit - start and old[len(old) - end - 1] == new[len(new) - end - 1]:
+            end += 1
+        if start + end == min(len(old), len(new)):
+            # Whole blocks were inserted or removed; include a neighbour to carry the separator
+            if start:
+                start -= 1
+            else:
+                end -= 1
+        self._blocks = new
+        position = sum(_utf16_len(text) + 1 for text in old[:start])
+        return (position, "\u2029".join(old[start:len(old) - end]),
+                "\u2029".join(new[start:len(new) - end]))
+
+    def _record(self, position, removed, added):
+        if self._redo:
+            for entry in self._redo:
+                self._memory -= entry.memory_size()
+                self._disk -= entry.disk_size()
+            self._redo = []
+
+        typing = len(removed) <= 1 and len(added) <= 1 and not self._grouping
+        last = self._undo[-1] if self._undo else None
+        if self._grouping and last is not None and last is self._group_entry:
+            before = last.memory_size()
+            if last.extend(position, removed, added):
+                self._memory += last.memory_size() - before
+                self._enforce_budget()
+                self._emit_state()
+                return
+        if (typing and last is not None and last.typing
+                and time.monotonic() - last.timestamp < UNDO_COALESCE_SECONDS):
+            before = last.memory_size()
+            if last.coalesce(position, removed, added):
+                self._memory += last.memory_size() - before
+                self._enforce_budget()
+                self._emit_state()
+                return
+
+        entry = UndoEntry(position, removed, added, typing)
+        if self._grouping:
+            self._group_entry = entry
+        self._undo.append(entry)
+        self._memory += entry.memory_size()
+        self._enforce_budget()
+        self._emit_state()
+
+    def _apply(self, position, length, text):
+        """Replace `length` characters at `position` with `text` without recording it."""
+        cursor = QTextCursor(self._document)
+        cursor.setPosition(position)
+        cursor.setPosition(position + length, QTextCursor.KeepAnchor)
+        self._replaying = True
+        try:
+            cursor.insertText(text)
+        finally:
+            self._replaying = False
+        self._editor.setTextCursor(cursor)
+        self._editor.ensureCursorVisible()
+
+    # --- Budget ---
+    def _enforce_budget(self):
+        if self._memory <= self.memory_budget:
+            return
+        older = self._undo[:max(0, len(self._undo) - UNDO_KEEP_RAW)]
+        # Recent entries stay raw for quick undo only while they are small; a big
+        # paste or Replace All would otherwise sit uncompressed far over the budget.
+        # The entry still collecting a group (streamed text) is left alone.
+        candidates = older + [entry for entry in self._undo[len(older):]
+                              if entry is not self._group_entry
+                              and (not entry.is_raw() or entry.text_size() >= UNDO_COMPRESS_MIN)]
+
+        # First compress large entries, oldest first
+        for entry in candidates:
+            if self._memory <= self.memory_budget:
+                return
+            if entry.is_raw() and entry.text_size() >= UNDO_COMPRESS_MIN:
+                before = entry.memory_size()
+                entry.compress()
+                self._memory += entry.memory_size() - before
+
+        # Then move them to disk
+        for entry in candidates:
+            if self._memory <= self.memory_budget:
+                break
+            if not entry.is_spilled():
+                if self._spill_file is None:
+                    self._spill_file = tempfile.TemporaryFile(prefix="undo-")
+                self._memory -= entry.memory_size()
+                entry.spill(self._spill_file)
+                self._disk += entry.disk_size()
+
+        # Finally drop the oldest entries once the disk budget is used up
+        dropped = 0
+        while self._disk > self.disk_budget and dropped < len(older):
+            entry = self._undo[dropped]
+            self._memory -= entry.memory_size()
+            self._disk -= entry.disk_size()
+            dropped += 1
+        if dropped:
+            del self._undo[:dropped]
+            # Dropped entries leave dead space behind; rewrite the file once it dominates
+            self._spill_file.seek(0, os.SEEK_END)
+            if self._spill_file.tell() > 2 * self.disk_budget:
+                self._compact_spill_file()
+
+    def _compact_spill_file(self):
+        old_file = self._spill_file
+        new_file = tempfile.TemporaryFile(prefix="undo-")
+        for entry in self._undo + self._redo:
+            entry.move_spill(old_file, new_file)
+        old_file.close()
+        self._spill_file = new_file
+
+    def _emit_state(self):
+        self.undoAvailable.emit(bool(self._undo))
+        self.redoAvailable.emit(bool(self._redo))
+        self.usageChanged.emit(self._memory, self._disk)
+
+
+# Large pastes
+PASTE_CHUNK_THRESHOLD = 2 * 1024 * 1024  # characters; smaller pastes are inserted in one go
+PASTE_CHUNK_SIZE = 256 * 1024            # characters inserted per event-loop turn
+
+
+def _normalize_newlines(text):
+    return text.replace("\r\n", "\n").replace("\r", "\n")
+
+
+class ChunkedPaste(QObject):
+    """Insert a large text into a QPlainTextEdit one chunk per event-loop turn.
+
+    Each chunk is its own edit, so layout and the document change handlers keep
+    up as the paste goes in instead of all running at the end; the undo history
+    groups the chunks into one undo step. The editor is read-only and its
+    viewport does not repaint until the paste ends.
+    """
+
+    progress = Signal(int)    # characters inserted so far
+    finished = Signal(bool)   # True if completed, False if cancelled
+
+    def __init__(self, editor, text, parent=None):
+        super().__init__(parent)
+        self._editor = editor
+        self._text = text
+        self._offset = 0
+        self._cancelled = False
+        self._cursor = editor.textCursor()
+        self._was_read_only = editor.isReadOnly()
+
+    def start(self):
+        self._editor.setReadOnly(True)
+        self._editor.viewport().setUpdatesEnabled(False)
+        self._editor.undo_history.begin_group()
+        self._cursor.removeSelectedText()
+        QTimer.singleShot(0, self._insert_next)
+
+    def cancel(self):
+        self._cancelled = True
+
+    def _insert_next(self):
+        if self._cancelled:
+            # Put the original selection back and leave nothing in the undo history
+            self._editor.undo_history.discard_group()
+            self._finish(False)
+            return
+
+        end = min(self._offset + PASTE_CHUNK_SIZE, len(self._text))
+        self._cursor.insertText(self._text[self._offset:end])
+        self._offset = end
+        self.progress.emit(end)
+        if end < len(self._text):
+            QTimer.singleShot(0, self._insert_next)
+        else:
+            self._finish(True)
+
+    def _finish(self, completed):
+        self._editor.undo_history.end_group()
+        self._editor.viewport().setUpdatesEnabled(True)
+        self._editor.setReadOnly(self._was_read_only)
+        if completed:
+            self._editor.setTextCursor(self._cursor)
+            self._editor.ensureCursorVisible()
+        self.finished.emit(completed)
+
+
+# Standard key sequences -> (cursor move, keep anchor), as the editor widget interprets them
+MACRO_MOVE_KEYS = [
+    (QKeySequence.MoveToPreviousChar, "left", False),
+    (QKeySequence.SelectPreviousChar, "left", True),
+    (QKeySequence.MoveToNextChar, "right", False),
+    (QKeySequence.SelectNextChar, "right", True),
+    (QKeySequence.MoveToPreviousWord, "word_left", False),
+    (QKeySequence.SelectPreviousWord, "word_left", True),
+    (QKeySequence.MoveToNextWord, "word_right", False),
+    (QKeySequence.SelectNextWord, "word_right", True),
+    (QKeySequence.MoveToPreviousLine, "up", False),
+    (QKeySequence.SelectPreviousLine, "up", True),
+    (QKeySequence.MoveToNextLine, "down", False),
+    (QKeySequence.SelectNextLine, "down", True),
+    (QKeySequence.MoveToStartOfLine, "line_start", False),
+    (QKeySequence.SelectStartOfLine, "line_start", True),
+    (QKeySequence.MoveToEndOfLine, "line_end", False),
+    (QKeySequence.SelectEndOfLine, "line_end", True),
+    (QKeySequence.MoveToStartOfBlock, "block_start", False),
+    (QKeySequence.SelectStartOfBlock, "block_start", True),
+    (QKeySequence.MoveToEndOfBlock, "block_end", False),
+    (QKeySequence.SelectEndOfBlock, "block_end", True),
+    (QKeySequence.MoveToStartOfDocument, "doc_start", False),
+    (QKeySequence.SelectStartOfDocument, "doc_start", True),
+    (QKeySequence.MoveToEndOfDocument, "doc_end", False),
+    (QKeySequence.SelectEndOfDocument, "doc_end", True),
+]
+
+# Page keys move the cursor by a viewport's worth of lines
+MACRO_PAGE_KEYS = [
+    (QKeySequence.MoveToPreviousPage, "up", False),
+    (QKeySequence.SelectPreviousPage, "up", True),
+    (QKeySequence.MoveToNextPage, "down", False),
+    (QKeySequence.SelectNextPage, "down", True),
+]
+
+MACRO_CURSOR_MOVES = {
+    "left": QTextCursor.Left,
+    "right": QTextCursor.Right,
+    "word_left": QTextCursor.WordLeft,
+    "word_right": QTextCursor.WordRight,
+    # Line moves use visual lines like the editor does, so they replay the same on
+    # wrapped paragraphs; QTextCursor lays out a block on demand inside the edit block
+    "up": QTextCursor.Up,
+    "down": QTextCursor.Down,
+    "line_start": QTextCursor.StartOfLine,
+    "line_end": QTextCursor.EndOfLine,
+    "block_start": QTextCursor.StartOfBlock,
+    "block_end": QTextCursor.EndOfBlock,
+    "doc_start": QTextCursor.Start,
+    "doc_end": QTextCursor.End,
+}
+
+
+class MacroRecorder:
+    """Records edits, cursor moves and search/replace steps and plays them back.
+
+    Steps are plain tuples such as ("insert", text) or ("move", name, keep_anchor, count).
+    Playback runs on a single QTextCursor inside one edit block with the
+    viewport's repaints suppressed, so the whole run is one undo step.
+    """
+
+    def __init__(self):
+        self.recording = False
+        self.steps = []
+
+    def start(self):
+        self.recording = True
+        self.steps = []
+
+    def stop(self):
+        self.recording = False
+
+    def has_macro(self):
+        return bool(self.steps) and not self.recording
+
+    def record(self, *step):
+        if not self.recording:
+            return
+        # Merge consecutive typing into one insert
+        if step[0] == "insert" and self.steps and self.steps[-1][0] == "insert":
+            self.steps[-1] = ("insert", self.steps[-1][1] + step[1])
+        else:
+            self.steps.append(step)
+
+    def record_key(self, event, page_lines=1):
+        """Translate a key press in the editor into a macro step.
+
+        `page_lines` is how many lines PageUp/PageDown move in the editor right now.
+        """
+        if not self.recording:
+            return
+        key = event.key()
+        modifiers = event.modifiers()
+        ctrl = bool(modifiers & Qt.ControlModifier)
+        for sequence, name, keep_anchor in MACRO_MOVE_KEYS:
+            if event.matches(sequence):
+                self.record("move", name, keep_anchor, 1)
+                return
+        for sequence, name, keep_anchor in MACRO_PAGE_KEYS:
+            if event.matches(sequence):
+                self.record("move", name, keep_anchor, page_lines)
+                return
+        if event.matches(QKeySequence.DeleteStartOfWord):
+            self.record("backspace_word")
+        elif event.matches(QKeySequence.DeleteEndOfWord):
+            self.record("delete_word")
+        elif key in (Qt.Key_Return, Qt.Key_Enter):
+            self.record("insert", "\n")
+        elif key == Qt.Key_Backspace:
+            self.record("backspace")
+        elif key == Qt.Key_Delete:
+            self.record("delete")
+        elif event.matches(QKeySequence.SelectAll):
+            self.record("select_all")
+        elif event.text() and not ctrl and not (modifiers & Qt.AltModifier) and (
+                event.text().isprintable() or event.text() == "\t"):
+            self.record("insert", event.text())
+
+    def play(self, editor, times=1):
+        """Play the macro `times` times, or until the end of the document if `times` is 0.
+
+        Returns the number of complete runs.
+        """
+        doc = editor.document()
+        cursor = editor.textCursor()
+        clipboard = [None]
+        runs = 0
+        editor.viewport().setUpdatesEnabled(False)
+        cursor.beginEditBlock()
+        try:
+            while times == 0 or runs < times:
+                remaining = doc.characterCount() - cursor.position()
+                if not self._run_once(doc, cursor, clipboard):
+                    break
+                runs += 1
+                # Until-end mode stops once a run no longer gets closer to the end
+                if times == 0 and (cursor.atEnd() or doc.characterCount() - cursor.position() >= remaining):
+                    break
+        finally:
+            cursor.endEditBlock()
+            editor.viewport().setUpdatesEnabled(True)
+        editor.setTextCursor(cursor)
+        editor.ensureCursorVisible()
+        if clipboard[0] is not None:
+            QApplication.clipboard().setText(clipboard[0])
+        return runs
+
+    def _run_once(self, doc, cursor, clipboard):
+        """Apply every step once. Returns False if a step could not be applied."""
+        for step in self.steps:
+            kind = step[0]
+            if kind == "insert":
+                cursor.insertText(step[1])
+            elif kind == "backspace":
+                if cursor.hasSelection():
+                    cursor.removeSelectedText()
+                else:
+                    cursor.deletePreviousChar()
+            elif kind == "delete":
+                if cursor.hasSelection():
+                    cursor.removeSelectedText()
+                else:
+                    cursor.deleteChar()
+            elif kind in ("backspace_word", "delete_word"):
+                if not cursor.hasSelection():
+                    word = QTextCursor.PreviousWord if kind == "backspace_word" else QTextCursor.NextWord
+                    cursor.movePosition(word, QTextCursor.KeepAnchor)
+                cursor.removeSelectedText()
+            elif kind == "move":
+                self._move(cursor, *step[1:])
+            elif kind == "select_all":
+                cursor.select(QTextCursor.Document)
+            elif kind in ("copy", "cut"):
+                if cursor.hasSelection():
+                    clipboard[0] = cursor.selectedText().replace("\u2029", "\n")
+                    if kind == "cut":
+                        cursor.removeSelectedText()
+            elif kind == "find":
+                if not self._find(doc, cursor, step[1], step[2]):
+                    return False
+            elif kind == "replace":
+                _, search, replace = step
+                # Same case rule as the search: QTextDocument.find ignores case by default
+                if cursor.selectedText().lower() == search.lower():
+                    cursor.insertText(replace)
+                if not self._find(doc, cursor, search, False):
+                    return False
+            elif kind == "replace_all":
+                _, search, replace = step
+                match = doc.find(search, 0)
+                while not match.isNull():
+                    match.insertText(replace)
+                    match = doc.find(search, match)
+        return True
+
+    @staticmethod
+    def _find(doc, cursor, text, backward):
+        match = doc.find(text, cursor, QTextDocument.FindBackward) if backward else doc.find(text, cursor)
+        if match.isNull():
+            return False
+        cursor.setPosition(match.anchor())
+        cursor.setPosition(match.position(), QTextCursor.KeepAnchor)
+        return True
+
+    @staticmethod
+    def _move(cursor, name, keep_anchor, count=1):
+        mode = QTextCursor.KeepAnchor if keep_anchor else QTextCursor.MoveAnchor
+        cursor.movePosition(MACRO_CURSOR_MOVES[name], mode, count)
+
+
+# Spell checking
+SPELL_WORD_LISTS = ["/usr/share/dict/words", "/usr/share/dict/american-english", "/usr/share/dict/british-english"]
+SPELL_CACHE_MAGIC = b"PSDICT1\0"
+SPELL_CACHE_HEADER = struct.Struct("<8sqqI4x")  # magic, source mtime (ns), source size, word count
+SPELL_RESULT_LIMIT = 20000   # block texts whose results are kept
+SPELL_PREFETCH_BLOCKS = 100  # blocks below the viewport checked at lower priority
+SPELL_UNDERLINE_COLOR = "#E05252"
+
+_SPELL_WORD_RE = re.compile(r"[^\W\d_]+(?:['\u2019][^\W\d_]+)*")
+
+
+def find_word_list():
+    """Return the first available system word list, or None."""
+    for path in SPELL_WORD_LISTS:
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+class SpellDictionary:
+    """Sorted lowercase word list, memory-mapped from a prebuilt cache file.
+
+    The cache holds a header, an array of uint32 offsets and the utf-8 words
+    back to back, so loading is an mmap and a lookup is a binary search. The
+    cache is rebuilt when the source word list changes.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        name = hashlib.sha1(os.path.abspath(source).encode("utf-8")).hexdigest()[:12]
+        self.cache_path = os.path.join(APP_CACHE_DIR, f"words-{name}.idx")
+        stat = os.stat(source)
+        buffer = self._map_cache(stat)
+        if buffer is None:
+            buffer = self._build_cache(stat)
+        self._attach(buffer)
+
+    def _map_cache(self, stat):
+        try:
+            with open(self.cache_path, "rb") as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        if len(buffer) >= SPELL_CACHE_HEADER.size:
+            magic, mtime, size, _ = SPELL_CACHE_HEADER.unpack_from(buffer, 0)
+            if magic == SPELL_CACHE_MAGIC and mtime == stat.st_mtime_ns and size == stat.st_size:
+                return buffer
+        buffer.close()
+        return None
+
+    def _build_cache(self, stat):
+        with open(self.source, "r", encoding="utf-8", errors="ignore") as f:
+            words = sorted({line.strip().lower().encode("utf-8") for line in f if line.strip()})
+        offsets = array("I", [0])
+        total = 0
+        for word in words:
+            total += len(word)
+            offsets.append(total)
+        data = b"".join((
+            SPELL_CACHE_HEADER.pack(SPELL_CACHE_MAGIC, stat.st_mtime_ns, stat.st_size, len(words)),
+            offsets.tobytes(),
+            b"".join(words),
+        ))
+        try:
+            os.makedirs(APP_CACHE_DIR, exist_ok=True)
+            tmp_path = self.cache_path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self.cache_path)
+        except OSError:
+            # Cache directory not writable; use the index from memory this time
+            pass
+        return data
+
+    def _attach(self, buffer):
+        _, _, _, count = SPELL_CACHE_HEADER.unpack_from(buffer, 0)
+        start = SPELL_CACHE_HEADER.size
+        self._buffer = buffer
+        self._count = count
+        self._offsets = memoryview(buffer)[start:start + 4 * (count + 1)].cast("I")
+        self._base = start + 4 * (count + 1)
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, word):
+        key = word.encode("utf-8")
+        buffer, offsets, base = self._buffer, self._offsets, self._base
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            current = buffer[base + offsets[mid]:base + offsets[mid + 1]]
+            if current < key:
+                lo = mid + 1
+            elif current > key:
+                hi = mid
+            else:
+                return True
+        return False
+
+    def is_correct(self, word):
+        lower = word.lower()
+        if lower in self:
+            return True
+        # Possessives and curly apostrophes
+        lower = lower.replace("\u2019", "'")
+        if lower.endswith("'s"):
+            lower = lower[:-2]
+        return lower in self
+
+    def misspellings(self, text):
+        """Return (start, length) of misspelled words in text, in UTF-16 units like Qt."""
+        spans = []
+        for match in _SPELL_WORD_RE.finditer(text):
+            word = match.group()
+            # Single letters and all-caps acronyms are left alone
+            if len(word) < 2 or word.isupper() or self.is_correct(word):
+                continue
+            spans.append((match.start(), len(word)))
+        if spans and _ASTRAL_RE.search(text):
+            # Characters outside the BMP take two UTF-16 units in Qt positions
+            spans = [(len(text[:start].encode("utf-16-le")) // 2, len(text[start:start + length].encode("utf-16-le")) // 2)
+                     for start, length in spans]
+        return spans
+
+
+class SpellChecker(QObject):
+    """Checks block texts on a worker thread and caches the results by text.
+
+    Because results are keyed by the block text, only new or changed blocks
+    are ever sent to the worker. Requests are prioritized (lower runs first).
+    """
+
+    checked = Signal()
+    failed = Signal(str)  # the word list could not be loaded; no requests will be answered
+    _resultReady = Signal(str, object)
+
+    def __init__(self, word_list, parent=None):
+        super().__init__(parent)
+        self._word_list = word_list
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._results = OrderedDict()  # block text -> list of (start, length)
+        self._pending = set()
+        self._resultReady.connect(self._store)
+        self._thread = threading.Thread(target=self._run, name="spell-check", daemon=True)
+        self._thread.start()
+
+    def misspellings(self, text):
+        """Return cached misspellings for a block text, or None if not checked yet."""
+        spans = self._results.get(text)
+        if spans is not None:
+            self._results.move_to_end(text)
+        return spans
+
+    def request(self, text, priority=0):
+        if text in self._pending:
+            return
+        self._pending.add(text)
+        self._queue.put((priority, next(self._sequence), text))
+
+    def cancel_pending(self):
+        """Drop queued requests that have not been picked up by the worker."""
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        self._pending.clear()
+
+    def shutdown(self):
+        self._queue.put((-1, -1, None))
+
+    def _run(self):
+        # The dictionary is loaded (or its cache built) off the UI thread
+        try:
+            dictionary = SpellDictionary(self._word_list)
+        except OSError as e:
+            self.failed.emit(str(e))
+            return
+        while True:
+            _, _, text = self._queue.get()
+            if text is None:
+                return
+            self._resultReady.emit(text, dictionary.misspellings(text))
+
+    def _store(self, text, spans):
+        self._pending.discard(text)
+        self._results[text] = spans
+        if len(self._results) > SPELL_RESULT_LIMIT:
+            self._results.popitem(last=False)
+        self.checked.emit()
+
+
+# Session restore
+SESSION_PATH = os.path.join(APP_CACHE_DIR, "session.bin")
+SESSION_MAGIC = b"PSSESS1\0"
+# magic, file mtime (ns), file size, cursor anchor, cursor position, visible region start/end
+# (byte offsets in the file, -1 if unknown), first visible block, then the lengths of the
+# geometry, path and search query blobs that follow the header
+SESSION_HEADER = struct.Struct("<8sqqqqqqqIII")
+SESSION_CHUNK_BYTES = 4 * 1024 * 1024  # bytes decoded and inserted per event-loop turn
+
+
+def _decode_text(data):
+    """Decode file bytes the same way open_file's text-mode read does."""
+    return data.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+
+
+def write_session(path, state):
+    """Write a session state dict to `path` in the compact binary format."""
+    geometry = state["geometry"]
+    file_path = state["path"].encode("utf-8")
+    search = state["search"].encode("utf-8")
+    header = SESSION_HEADER.pack(
+        SESSION_MAGIC, state["mtime_ns"], state["size"], state["anchor"], state["position"],
+        state["visible_start"], state["visible_end"], state["first_block"],
+        len(geometry), len(file_path), len(search))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header + geometry + file_path + search)
+    os.replace(tmp_path, path)
+
+
+def read_session(path):
+    """Return the session state dict stored at `path`, or None if missing or invalid."""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        (magic, mtime_ns, size, anchor, position, visible_start, visible_end, first_block,
+         geometry_len, path_len, search_len) = SESSION_HEADER.unpack_from(data, 0)
+    except (OSError, struct.error):
+        return None
+    offset = SESSION_HEADER.size
+    if magic != SESSION_MAGIC or len(data) != offset + geometry_len + path_len + search_len:
+        return None
+    geometry = data[offset:offset + geometry_len]
+    offset += geometry_len
+    file_path = data[offset:offset + path_len].decode("utf-8", "replace")
+    offset += path_len
+    search = data[offset:offset + search_len].decode("utf-8", "replace")
+    return {
+        "geometry": geometry, "path": file_path, "search": search,
+        "mtime_ns": mtime_ns, "size": size, "anchor": anchor, "position": position,
+        "visible_start": visible_start, "visible_end": visible_end, "first_block": first_block,
+    }
+
+
+class SessionFileLoader(QObject):
+    """Load file bytes into the editor, visible region first.
+
+    Only the bytes of the region that was on screen are decoded up front; the
+    text before it is then inserted at the top and the text after it appended,
+    one chunk per event-loop turn, while the view stays on the visible region.
+    Chunks always end at line breaks so they can be decoded independently.
+    Every byte is still decoded once; only the order changes. If a chunk fails
+    to decode, loading stops and `error` holds the message.
+    """
+
+    finished = Signal()
+
+    def __init__(self, editor, data, visible_start, visible_end, parent=None):
+        super().__init__(parent)
+        self._editor = editor
+        self._data = data
+        self._prefix_end = visible_start    # bytes [0, prefix_end) still to insert at the top
+        self._suffix_start = visible_end    # bytes [suffix_start, len) still to append
+        self._anchor = None
+        self._cancelled = False
+        self.error = None
+
+    def cancel(self):
+        """Stop loading (e.g. another file is being opened) and leave the editor usable."""
+        if not self._cancelled:
+            self._cancelled = True
+            self._finish()
+
+    def start(self):
+        editor = self._editor
+        editor.clear()
+        editor.setReadOnly(True)
+        editor.undo_history.suspend()
+        document = editor.document()
+        try:
+            QTextCursor(document).insertText(_decode_text(self._data[self._prefix_end:self._suffix_start]))
+        except UnicodeDecodeError as e:
+            self._fail(e)
+            return
+        # Stays at the start of the visible region as text is inserted above it
+        self._anchor = QTextCursor(document)
+        QTimer.singleShot(0, self._load_next)
+
+    def _load_next(self):
+        if self._cancelled:
+            return
+        try:
+            loaded = self._load_chunk()
+        except UnicodeDecodeError as e:
+            # The file can change without its mtime and size changing
+            self._fail(e)
+            return
+        if loaded:
+            QTimer.singleShot(0, self._load_next)
+        else:
+            self._finish()
+
+    def _load_chunk(self):
+        """Insert the next chunk; return False once everything is loaded."""
+        data = self._data
+        document = self._editor.document()
+        if self._prefix_end > 0:
+            start = max(0, self._prefix_end - SESSION_CHUNK_BYTES)
+            if start > 0:
+                start = data.rfind(b"\n", 0, start) + 1
+            QTextCursor(document).insertText(_decode_text(data[start:self._prefix_end]))
+            self._prefix_end = start
+            self._editor.verticalScrollBar().setValue(self._anchor.block().firstLineNumber())
+        elif self._suffix_start < len(data):
+            end = min(len(data), self._suffix_start + SESSION_CHUNK_BYTES)
+            if end < len(data):
+                newline = data.find(b"\n", end)
+                end = len(data) if newline < 0 else newline + 1
+            cursor = QTextCursor(document)
+            cursor.movePosition(QTextCursor.End)
+            cursor.insertText(_decode_text(data[self._suffix_start:end]))
+            self._suffix_start = end
+        else:
+            return False
+        return True
+
+    def _fail(self, error):
+        self.error = str(error)
+        self._cancelled = True
+        self._finish()
+
+    def _finish(self):
+        editor = self._editor
+        editor.undo_history.resume()
+        editor.undo_history.reset()
+        editor.reset_modified_lines()
+        editor.setReadOnly(False)
+        self._data = None
+        self.finished.emit()
+
+
+# File compare
+DIFF_MAX_COST = 256  # edit distance explored per bisection before falling back to a heuristic split
+
+
+class DiffCancelled(Exception):
+    """Raised inside a diff when its cancel check returns True."""
+
+
+def intern_lines(a_lines, b_lines):
+    """Map the lines of both files to small integers; equal lines get equal ids."""
+    table = {}
+    a = [table.setdefault(line, len(table)) for line in a_lines]
+    b = [table.setdefault(line, len(table)) for line in b_lines]
+    return a, b
+
+
+def _unique_anchors(a, b, a0, a1, b0, b1):
+    """Return (i, j) pairs of lines that occur once in a[a0:a1] and once in b[b0:b1].
+
+    Only the longest run of pairs in the same order on both sides is kept
+    (patience diff), so the pairs can be matched without searching.
+    """
+    a_once = {line for line, count in Counter(a[a0:a1]).items() if count == 1}
+    b_once = {line for line, count in Counter(b[b0:b1]).items() if count == 1}
+    unique = a_once & b_once
+    if not unique:
+        return []
+    b_position = {line: j for j, line in enumerate(b[b0:b1], b0) if line in unique}
+    pairs = [(i, b_position[line]) for i, line in enumerate(a[a0:a1], a0) if line in unique]
+    # Longest increasing subsequence of the b positions, by patience sorting
+    tails = []      # smallest b position ending an increasing run of each length
+    tail_index = []
+    previous = [-1] * len(pairs)
+    for index, (_, j) in enumerate(pairs):
+        length = bisect.bisect_left(tails, j)
+        if length == len(tails):
+            tails.append(j)
+            tail_index.append(index)
+        else:
+            tails[length] = j
+            tail_index[length] = index
+        previous[index] = tail_index[length - 1] if length else -1
+    anchors = []
+    index = tail_index[-1] if tail_index else -1
+    while index != -1:
+        anchors.append(pairs[index])
+        index = previous[index]
+    anchors.reverse()
+    return anchors
+
+
+def _middle_snake(a, b, a0, a1, b0, b1, cancelled=None):
+    """Find where an optimal path through a[a0:a1] x b[b0:b1] crosses the middle.
+
+    Linear-space Myers bisection: forward and reverse paths are extended one
+    edit at a time in O(N + M) memory until they overlap. Returns the split
+    point (x, y), or None if the ranges share nothing. Past DIFF_MAX_COST edits
+    it splits where the forward search got furthest instead, like GNU diff, so
+    very different ranges cost O((N + M) * DIFF_MAX_COST) rather than O(N * M).
+    """
+    n = a1 - a0
+    m = b1 - b0
+    max_d = min((n + m + 1) // 2, DIFF_MAX_COST)
+    v_offset = max_d
+    v_length = 2 * max_d + 2
+    v1 = [-1] * v_length
+    v2 = [-1] * v_length
+    v1[v_offset + 1] = 0
+    v2[v_offset + 1] = 0
+    delta = n - m
+    front = delta % 2 != 0
+    k1start = k1end = k2start = k2end = 0
+    for d in range(max_d):
+        if cancelled is not None and cancelled():
+            raise DiffCancelled
+        # Forward path
+        for k1 in range(-d + k1start, d + 1 - k1end, 2):
+            k1_offset = v_offset + k1
+            if k1 == -d or (k1 != d and v1[k1_offset - 1] < v1[k1_offset + 1]):
+                x1 = v1[k1_offset + 1]
+            else:
+                x1 = v1[k1_offset - 1] + 1
+            y1 = x1 - k1
+            while x1 < n and y1 < m and a[a0 + x1] == b[b0 + y1]:
+                x1 += 1
+                y1 += 1
+            v1[k1_offset] = x1
+            if x1 > n:
+                k1end += 2
+            elif y1 > m:
+                k1start += 2
+            elif front:
+                k2_offset = v_offset + delta - k1
+                if 0 <= k2_offset < v_length and v2[k2_offset] != -1:
+                    if x1 >= n - v2[k2_offset]:
+                        return a0 + x1, b0 + y1
+        # Reverse path
+        for k2 in range(-d + k2start, d + 1 - k2end, 2):
+            k2_offset = v_offset + k2
+            if k2 == -d or (k2 != d and v2[k2_offset - 1] < v2[k2_offset + 1]):
+                x2 = v2[k2_offset + 1]
+            else:
+                x2 = v2[k2_offset - 1] + 1
+            y2 = x2 - k2
+            while x2 < n and y2 < m and a[a1 - x2 - 1] == b[b1 - y2 - 1]:
+                x2 += 1
+                y2 += 1
+            v2[k2_offset] = x2
+            if x2 > n:
+                k2end += 2
+            elif y2 > m:
+                k2start += 2
+            elif not front:
+                k1_offset = v_offset + delta - k2
+                if 0 <= k1_offset < v_length and v1[k1_offset] != -1:
+                    x1 = v1[k1_offset]
+                    y1 = v_offset + x1 - k1_offset
+                    if x1 >= n - x2:
+                        return a0 + x1, b0 + y1
+    if max_d == (n + m + 1) // 2:
+        return None
+    # Too expensive: take the forward point closest to the end, if it makes progress
+    best_x = best_y = 0
+    for k1_offset in range(v_length):
+        x1 = v1[k1_offset]
+        y1 = x1 - (k1_offset - v_offset)
+        if 0 <= x1 <= n and 0 <= y1 <= m and x1 + y1 > best_x + best_y:
+            best_x, best_y = x1, y1
+    if best_x + best_y in (0, n + m):
+        return None
+    return a0 + best_x, b0 + best_y
+
+
+def _matching_runs(a, b, cancelled=None):
+    """Return sorted (i, j, length) runs where a[i:i+length] == b[j:j+length]."""
+    runs = []
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        if cancelled is not None and cancelled():
+            raise DiffCancelled
+        a0, a1, b0, b1 = stack.pop()
+        # Common prefix and suffix are matched directly
+        start = a0
+        while a0 < a1 and b0 < b1 and a[a0] == b[b0]:
+            a0 += 1
+            b0 += 1
+        if a0 > start:
+            runs.append((start, b0 - (a0 - start), a0 - start))
+        end = a1
+        while a0 < a1 and b0 < b1 and a[a1 - 1] == b[b1 - 1]:
+            a1 -= 1
+            b1 -= 1
+        if a1 < end:
+            runs.append((a1, b1, end - a1))
+        if a0 == a1 or b0 == b1:
+            continue
+        anchors = _unique_anchors(a, b, a0, a1, b0, b1)
+        if anchors:
+            # Each range after the first starts with its anchor, matched as a common prefix
+            bounds = [(a0, b0)] + anchors + [(a1, b1)]
+            for (x0, y0), (x1, y1) in zip(bounds, bounds[1:]):
+                stack.append((x0, x1, y0, y1))
+            continue
+        split = _middle_snake(a, b, a0, a1, b0, b1, cancelled)
+        if split is None:
+            continue
+        x, y = split
+        stack.append((x, a1, y, b1))
+        stack.append((a0, x, b0, y))
+    runs.sort()
+    return runs
+
+
+def diff_line_ids(a, b, cancelled=None):
+    """Diff two sequences of line ids and return difflib-style opcodes.
+
+    Lines that occur in only one of the files can never match, so they are
+    dropped before running the diff on what is left. `cancelled` is polled
+    while diffing; DiffCancelled is raised once it returns True.
+    """
+    common = set(a).intersection(b)
+    a_index = [i for i, line in enumerate(a) if line in common]
+    b_index = [j for j, line in enumerate(b) if line in common]
+    a_kept = [a[i] for i in a_index]
+    b_kept = [b[j] for j in b_index]
+
+    # Map matches back to original line numbers, splitting runs where discarded lines were
+    runs = []
+    for i, j, length in _matching_runs(a_kept, b_kept, cancelled):
+        for k in range(i, i + length):
+            ai, bj = a_index[k], b_index[k - i + j]
+            if runs and runs[-1][0] + runs[-1][2] == ai and runs[-1][1] + runs[-1][2] == bj:
+                runs[-1][2] += 1
+            else:
+                runs.append([ai, bj, 1])
+
+    opcodes = []
+    i = j = 0
+    for ai, bj, length in runs + [[len(a), len(b), 0]]:
+        if i < ai and j < bj:
+            opcodes.append(("replace", i, ai, j, bj))
+        elif i < ai:
+            opcodes.append(("delete", i, ai, j, j))
+        elif j < bj:
+            opcodes.append(("insert", i, i, j, bj))
+        if length:
+            opcodes.append(("equal", ai, ai + length, bj, bj + length))
+        i, j = ai + length, bj + length
+    return opcodes
+
+
+class DiffJob(QObject):
+    """Diffs two lists of lines on a worker thread."""
+
+    finished = Signal(object)  # opcodes
+
+    def __init__(self, left_lines, right_lines, parent=None):
+        super().__init__(parent)
+        self._left = left_lines
+        self._right = right_lines
+        self._cancelled = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, name="diff", daemon=True).start()
+
+    def cancel(self):
+        """Stop the diff; `finished` is not emitted."""
+        self._cancelled.set()
+
+    def _run(self):
+        try:
+            opcodes = diff_line_ids(*intern_lines(self._left, self._right), self._cancelled.is_set)
+        except DiffCancelled:
+            return
+        self.finished.emit(opcodes)
+
+
+class DiffView(QAbstractScrollArea):
+    """Two diff columns sharing one scrollbar.
+
+    Rows are painted straight from the opcodes, so only the rows on screen are
+    ever laid out, whatever the size of the files.
+    """
+
+    ROW_COLORS = {"replace": "#3A3A1E", "delete": "#4B1818", "insert": "#1E3A1E"}
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._left = []
+        self._right = []
+        self._opcodes = []
+        self._row_starts = [0]  # first row of each opcode, plus the total row count
+        self._longest_line = 0
+        self._text_color = self.palette().color(QPalette.Text)
+        self._background_color = self.palette().color(QPalette.Base)
+        self.verticalScrollBar().valueChanged.connect(self.viewport().update)
+        self.horizontalScrollBar().valueChanged.connect(self.viewport().update)
+
+    def set_colors(self, text_color, background_color):
+        self._text_color = QColor(text_color)
+        self._background_color = QColor(background_color)
+        self.viewport().update()
+
+    def set_diff(self, left_lines, right_lines, opcodes):
+        self._left = left_lines
+        self._right = right_lines
+        self._opcodes = opcodes
+        self._longest_line = max(max(map(len, left_lines), default=0), max(map(len, right_lines), default=0))
+        self._row_starts = [0]
+        for _, i1, i2, j1, j2 in opcodes:
+            self._row_starts.append(self._row_starts[-1] + max(i2 - i1, j2 - j1))
+        self._update_scrollbars()
+        self.viewport().update()
+
+    def hunk_count(self):
+        return sum(1 for op in self._opcodes if op[0] != "equal")
+
+    def _row_height(self):
+        return self.fontMetrics().height()
+
+    def _update_scrollbars(self):
+        visible = max(1, self.viewport().height() // self._row_height())
+        self.verticalScrollBar().setRange(0, max(0, self._row_starts[-1] - visible))
+        self.verticalScrollBar().setPageStep(visible)
+        column = self.viewport().width() // 2
+        text_width = self._longest_line * self.fontMetrics().horizontalAdvance("M")
+        self.horizontalScrollBar().setRange(0, max(0, text_width - column // 2))
+        self.horizontalScrollBar().setPageStep(column)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self._update_scrollbars()
+
+    def goto_hunk(self, forward=True):
+        """Scroll to the next (or previous) change."""
+        top = self.verticalScrollBar().value()
+        hunks = [start for start, op in zip(self._row_starts, self._opcodes) if op[0] != "equal"]
+        if forward:
+            targets = [row for row in hunks if row > top]
+            target = targets[0] if targets else None
+        else:
+            targets = [row for row in hunks if row < top]
+            target = targets[-1] if targets else None
+        if target is not None:
+            self.verticalScrollBar().setValue(target)
+
+    def paintEvent(self, event):
+        painter = QPainter(self.viewport())
+        painter.setFont(self.font())
+        row_height = self._row_height()
+        width = self.viewport().width()
+        column = width // 2
+        gutter = self.fontMetrics().horizontalAdvance("9") * (len(str(max(len(self._left), len(self._right), 1))) + 1)
+        text_color = self._text_color
+        number_color = QColor(text_color)
+        number_color.setAlpha(140)
+        scroll_x = self.horizontalScrollBar().value()
+        painter.fillRect(event.rect(), self._background_color)
+
+        first = self.verticalScrollBar().value()
+        rows = self.viewport().height() // row_height + 1
+        for index in range(rows):
+            row = first + index
+            if row >= self._row_starts[-1]:
+                break
+            op = bisect.bisect_right(self._row_starts, row) - 1
+            tag, i1, i2, j1, j2 = self._opcodes[op]
+            offset = row - self._row_starts[op]
+            y = index * row_height
+            sides = ((0, self._left, i1 + offset if offset < i2 - i1 else None),
+                     (column, self._right, j1 + offset if offset < j2 - j1 else None))
+            for left_edge, lines, line in sides:
+                if tag != "equal":
+                    painter.fillRect(left_edge, y, column, row_height, QColor(self.ROW_COLORS[tag]))
+                if line is None:
+                    continue
+                painter.setPen(number_color)
+                painter.drawText(left_edge, y, gutter - 4, row_height, Qt.AlignRight, str(line + 1))
+                painter.setPen(text_color)
+                painter.setClipRect(left_edge + gutter, y, column - gutter, row_height)
+                painter.drawText(left_edge + gutter + 4 - scroll_x, y + self.fontMetrics().ascent(),
+                                 lines[line].expandtabs(FOLD_TAB_WIDTH))
+                painter.setClipping(False)
+        painter.setPen(number_color)
+        painter.drawLine(column, 0, column, self.viewport().height())
+        painter.end()
+
+
+class CompareWindow(QWidget):
+    """Side-by-side comparison of the editor buffer with another file."""
+
+    def __init__(self, left_title, left_lines, right_title, right_lines, editor, parent=None):
+        super().__init__(parent, Qt.Window)
+        self.setWindowTitle(f"Compare: {left_title} ↔ {right_title}")
+        self.resize(1100, 700)
+
+        layout = QVBoxLayout()
+        header = QHBoxLayout()
+        header.addWidget(QLabel(left_title))
+        header.addStretch()
+        self.status_label = QLabel("Comparing...")
+        header.addWidget(self.status_label)
+        self.prev_button = QPushButton("▲")
+        self.prev_button.setMaximumWidth(40)
+        self.prev_button.setToolTip("Previous change")
+        self.prev_button.setEnabled(False)
+        header.addWidget(self.prev_button)
+        self.next_button = QPushButton("▼")
+        self.next_button.setMaximumWidth(40)
+        self.next_button.setToolTip("Next change")
+        self.next_button.setEnabled(False)
+        header.addWidget(self.next_button)
+        header.addStretch()
+        header.addWidget(QLabel(right_title))
+        layout.addLayout(header)
+
+        self.view = DiffView()
+        self.view.setFont(editor.font())
+        self.view.set_colors(editor._get_editor_text_color(), editor._get_editor_background_color())
+        layout.addWidget(self.view)
+        self.setLayout(layout)
+
+        self.prev_button.clicked.connect(lambda: self.view.goto_hunk(False))
+        self.next_button.clicked.connect(lambda: self.view.goto_hunk(True))
+
+        self._left = left_lines
+        self._right = right_lines
+        # No parent: the job outlives the window if it is closed while diffing
+        self._job = DiffJob(left_lines, right_lines)
+        self._job.finished.connect(self._on_diff_finished)
+        self._job.start()
+
+    def closeEvent(self, event):
+        self._job.cancel()
+        super().closeEvent(event)
+
+    def _on_diff_finished(self, opcodes):
+        self.view.set_diff(self._left, self._right, opcodes)
+        hunks = self.view.hunk_count()
+        self.status_label.setText(f"{hunks} change(s)" if hunks else "Files are identical")
+        self.prev_button.setEnabled(hunks > 0)
+        self.next_button.setEnabled(hunks > 0)
+        self.view.goto_hunk(True)
+
+
+# Assistant
+AGENT_OLLAMA_HOST = "127.0.0.1"
+AGENT_OLLAMA_PORT = 11434
+AGENT_OLLAMA_MODEL = "llama3"
+AGENT_CONTEXT_BEFORE = 4000       # characters of context sent from before the cursor
+AGENT_CONTEXT_AFTER = 1000        # ...and from after it
+AGENT_CONTEXT_SELECTION = 8000    # characters of a selection sent, half from each end
+AGENT_FLUSH_INTERVAL_MS = 16      # tokens are inserted at most once per frame
+
+
+async def _http_body_lines(reader, chunked):
+    """Yield lines of an HTTP response body, handling chunked transfer encoding."""
+    if not chunked:
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            yield line
+    pending = b""
+    while True:
+        size = int((await reader.readline()).split(b";")[0].strip() or b"0", 16)
+        if size == 0:
+            break
+        pending += await reader.readexactly(size)
+        await reader.readline()  # CRLF after each chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+
+class AgentBackend(abc.ABC):
+    """A source of streamed completions."""
+
+    @abc.abstractmethod
+    def stream(self, prompt):
+        """Return an async iterator of text pieces; subclasses write it as an async generator."""
+
+
+class OllamaBackend(AgentBackend):
+    """Streams from a local Ollama-compatible /api/generate endpoint (newline-delimited JSON)."""
+
+    def __init__(self, host=AGENT_OLLAMA_HOST, port=AGENT_OLLAMA_PORT, model=AGENT_OLLAMA_MODEL):
+        self.host = host
+        self.port = port
+        self.model = model
+
+    async def stream(self, prompt):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            body = json.dumps({"model": self.model, "prompt": prompt, "stream": True}).encode("utf-8")
+            writer.write(
+                f"POST /api/generate HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode("ascii") + body)
+            await writer.drain()
+
+            status = (await reader.readline()).decode("latin-1").strip()
+            if status.split(" ")[1:2] != ["200"]:
+                raise ConnectionError(f"Assistant backend replied: {status or 'no response'}")
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip().lower()
+
+            chunked = "chunked" in headers.get("transfer-encoding", "")
+            async for line in _http_body_lines(reader, chunked):
+                if not line.strip():
+                    continue
+                message = json.loads(line)
+                if message.get("error"):
+                    raise ConnectionError(message["error"])
+                if message.get("response"):
+                    yield message["response"]
+                if message.get("done"):
+                    break
+        finally:
+            writer.close()
+
+
+class FakeLocalServer:
+    """A tiny Ollama-compatible streaming server, for trying the panel without a model."""
+
+    def __init__(self, delay=0.01):
+        self.delay = delay
+        self.port = None
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    @staticmethod
+    def reply_for(prompt):
+        """The canned completion streamed back for a prompt."""
+        request = prompt.split("\n", 1)[0].strip()
+        return f"(fake assistant) You asked: {request}"
+
+    async def _handle(self, reader, writer):
+        try:
+            length = 0
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                name, _, value = line.partition(":")
+                if name.strip().lower() == "content-length":
+                    length = int(value)
+            prompt = json.loads(await reader.readexactly(length)).get("prompt", "")
+
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n"
+                         b"Transfer-Encoding: chunked\r\n\r\n")
+            for token in re.findall(r"\S+\s*", self.reply_for(prompt)):
+                self._write_chunk(writer, {"response": token, "done": False})
+                await writer.drain()
+                await asyncio.sleep(self.delay)
+            self._write_chunk(writer, {"response": "", "done": True})
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _write_chunk(writer, message):
+        data = json.dumps(message).encode("utf-8") + b"\n"
+        writer.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+
+
+class FakeLocalBackend(AgentBackend):
+    """Runs a FakeLocalServer and streams from it through the regular HTTP client."""
+
+    async def stream(self, prompt):
+        server = FakeLocalServer()
+        await server.start()
+        try:
+            async for token in OllamaBackend("127.0.0.1", server.port).stream(prompt):
+                yield token
+        finally:
+            await server.close()
+
+
+AGENT_BACKENDS = {
+    "Local model (Ollama)": OllamaBackend,
+    "Fake local server": FakeLocalBackend,
+}
+
+
+def build_agent_prompt(instruction, before, selection, after):
+    """Combine the user's request with the text around the cursor."""
+    parts = [instruction, "", "--- Text before the cursor ---", before]
+    if selection:
+        parts += ["--- Selected text ---", selection]
+    parts += ["--- Text after the cursor ---", after, "",
+              "Reply only with the text to insert at the cursor."]
+    return "\n".join(parts)
+
+
+class AgentRequest(QObject):
+    """Runs one streamed completion on an asyncio loop in a worker thread."""
+
+    token = Signal(str)
+    finished = Signal(str)  # error message, or "" on success
+
+    def __init__(self, backend, prompt, parent=None):
+        super().__init__(parent)
+        self._backend = backend
+        self._prompt = prompt
+        self._loop = None
+        self._task = None
+        self._cancelled = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, name="assistant", daemon=True).start()
+
+    def cancel(self):
+        # The flag covers a request whose loop has not started yet (or has already
+        # closed); cancelling the task also interrupts a read waiting for the next token
+        self._cancelled.set()
+        loop, task = self._loop, self._task
+        if loop is None or task is None or loop.is_closed():
+            return
+        try:
+            loop.call_soon_threadsafe(task.cancel)
+        except RuntimeError:
+            pass  # the loop closed in the meantime
+
+    def _run(self):
+        error = ""
+        try:
+            asyncio.run(self._main())
+        except asyncio.CancelledError:
+            error = "Stopped"
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        self.finished.emit(error)
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.current_task()
+        if self._cancelled.is_set():
+            raise asyncio.CancelledError
+        async for token in self._backend.stream(self._prompt):
+            if self._cancelled.is_set():
+                raise asyncio.CancelledError
+            self.token.emit(token)
+
+
+class TokenInserter(QObject):
+    """Buffers streamed tokens and inserts them into the editor once per frame.
+
+    The whole response is grouped into a single undo step, and the editor is
+    read-only while it streams so the inserted text stays contiguous.
+    """
+
+    def __init__(self, editor, parent=None):
+        super().__init__(parent)
+        self._editor = editor
+        self._buffer = []
+        cursor = editor.textCursor()
+        cursor.setPosition(cursor.selectionEnd())
+        self._cursor = cursor
+        self._was_read_only = editor.isReadOnly()
+        self._timer = QTimer(self)
+        self._timer.setInterval(AGENT_FLUSH_INTERVAL_MS)
+        self._timer.timeout.connect(self.flush)
+
+    def start(self):
+        self._editor.setReadOnly(True)
+        self._editor.undo_history.begin_group()
+        self._timer.start()
+
+    def add(self, token):
+        self._buffer.append(token)
+
+    def flush(self):
+        if not self._buffer:
+            return
+        text = "".join(self._buffer)
+        self._buffer = []
+        self._cursor.insertText(text)
+        self._editor.setTextCursor(self._cursor)
+        self._editor.ensureCursorVisible()
+
+    def finish(self):
+        self._timer.stop()
+        self.flush()
+        self._editor.undo_history.end_group()
+        self._editor.setReadOnly(self._was_read_only)
+
+
+class AgentPanel(QWidget):
+    """Assistant panel: backend choice, request input and send/stop buttons."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        layout = QVBoxLayout()
+        layout.setContentsMargins(5, 5, 5, 5)
+
+        self.backend_combo = QComboBox()
+        self.backend_combo.addItems(list(AGENT_BACKENDS))
+        self.backend_combo.setToolTip("Where completions come from")
+        layout.addWidget(self.backend_combo)
+
+        self.prompt_input = QLineEdit()
+        self.prompt_input.setPlaceholderText("Ask the assistant...")
+        layout.addWidget(self.prompt_input)
+
+        buttons = QHBoxLayout()
+        self.send_button = QPushButton("Send")
+        self.send_button.setToolTip("Insert the assistant's reply at the cursor (Enter)")
+        buttons.addWidget(self.send_button)
+        self.stop_button = QPushButton("Stop")
+        self.stop_button.setEnabled(False)
+        buttons.addWidget(self.stop_button)
+        layout.addLayout(buttons)
+
+        self.status_label = QLabel("")
+        self.status_label.setWordWrap(True)
+        self.status_label.setStyleSheet("color: #dddddd;")  # Light text for dark theme visibility
+        layout.addWidget(self.status_label)
+        layout.addStretch()
+        self.setLayout(layout)
+
+    def set_busy(self, busy):
+        self.send_button.setEnabled(not busy)
+        self.prompt_input.setEnabled(not busy)
+        self.backend_combo.setEnabled(not busy)
+        self.stop_button.setEnabled(busy)
+
+    def get_prompt(self):
+        return self.prompt_input.text()
+
+    def get_backend(self):
+        return AGENT_BACKENDS[self.backend_combo.currentText()]()
+
+
 class TextEditor(QMainWindow):
 
     def __init__(self):
@@ -160,6 +2001,22 @@ class TextEditor(QMainWindow):
         # Search tracking variables
         self.current_matches = []  # List of QTextCursor positions for matches
         self.current_match_index = 0  # Current match being viewed
+        # The match cursors follow edits but the overview ruler holds block numbers,
+        # so those are recomputed shortly after the text changes
+        self._overview_timer = QTimer(self)
+        self._overview_timer.setSingleShot(True)
+        self._overview_timer.setInterval(300)
+        self._overview_timer.timeout.connect(self._refresh_overview_matches)
+        self.editor.textChanged.connect(self._schedule_overview_refresh)
+
+        # Paste tracking: normalized clipboard text (cleared when the clipboard changes)
+        # and the chunked paste in progress, if any
+        self._paste_buffer = None
+        self._paste_job = None
+        # Loader for the file restored from the last session, while it is still loading
+        self._session_loader = None
+        QApplication.clipboard().dataChanged.connect(self._on_clipboard_changed)
+        self.editor.paste_handler = self._paste_text
         
         # Connect search widget signals
         self.search_widget.search_input.textChanged.connect(self._on_search_text_changed)
@@ -169,8 +2026,22 @@ class TextEditor(QMainWindow):
         self.search_widget.replace_button.clicked.connect(self._replace_current)
         self.search_widget.replace_all_button.clicked.connect(self._replace_all)
         
+        # Assistant panel, docked on the right and hidden until the Agent button is used
+        self.agent_panel = AgentPanel()
+        self.agent_dock = QDockWidget("Assistant", self)
+        self.agent_dock.setWidget(self.agent_panel)
+        self.addDockWidget(Qt.RightDockWidgetArea, self.agent_dock)
+        self.agent_dock.hide()
+        self._agent_request = None
+        self._agent_inserter = None
+        self.agent_panel.send_button.clicked.connect(self._on_agent_send)
+        self.agent_panel.prompt_input.returnPressed.connect(self._on_agent_send)
+        self.agent_panel.stop_button.clicked.connect(self._on_agent_stop)
+
         # Install event filter for Enter/Escape keys in search widget
         self.search_widget.search_input.installEventFilter(self)
+        # ...and on the editor, so Copy/Cut/Paste keys go through our actions
+        self.editor.installEventFilter(self)
 
         # create actions first so toolbar and menubar can reuse them
         self.create_actions()
@@ -179,8 +2050,10 @@ class TextEditor(QMainWindow):
         # create status bar showing Ln/Col and word count
         self.create_statusbar()
         self.current_file = None
+        self._file_stat = None  # (mtime_ns, size) of current_file when last loaded or saved
         self.untitled_count = 1
         self.update_window_title()
+        self.restore_session()
 
 
     def create_actions(self):
@@ -264,9 +2137,68 @@ class TextEditor(QMainWindow):
         self.repeat_action.setShortcut(QKeySequence("Ctrl+Shift+Y"))  # Shift+Ctrl+Y
         self.repeat_action.triggered.connect(self._on_repeat)
 
+        # Macro recording and playback
+        self.record_macro_action = QAction("Record Macro", self)
+        self.record_macro_action.setCheckable(True)
+        self.record_macro_action.setShortcut(QKeySequence("Ctrl+Shift+R"))
+        self.record_macro_action.toggled.connect(self._on_record_macro)
+        self.record_macro_action.setStatusTip("Start or stop recording edits as a macro")
+
+        self.play_macro_action = QAction("Play Macro...", self)
+        self.play_macro_action.setShortcut(QKeySequence("Ctrl+Shift+P"))
+        self.play_macro_action.triggered.connect(self._on_play_macro)
+        self.play_macro_action.setStatusTip("Run the recorded macro one or more times")
+        self.play_macro_action.setEnabled(False)
+
+        # Spell checking (only available when a system word list exists)
+        self._spell_checker = None
+        self._word_list = find_word_list()
+        self.spell_action = QAction("Check Spelling", self)
+        self.spell_action.setCheckable(True)
+        self.spell_action.toggled.connect(self._on_toggle_spelling)
+        if self._word_list:
+            self.spell_action.setStatusTip("Underline misspelled words")
+        else:
+            self.spell_action.setEnabled(False)
+            self.spell_action.setStatusTip("No word list found for spell checking")
+
+        # Folding
+        self.fold_action = QAction("Fold", self)
+        self.fold_action.setShortcut(QKeySequence("Ctrl+Shift+["))
+        self.fold_action.triggered.connect(self.editor.fold_at_cursor)
+        self.fold_action.setStatusTip("Collapse the region around the cursor")
+
+        self.unfold_action = QAction("Unfold", self)
+        self.unfold_action.setShortcut(QKeySequence("Ctrl+Shift+]"))
+        self.unfold_action.triggered.connect(self.editor.unfold_at_cursor)
+        self.unfold_action.setStatusTip("Expand the region at the cursor")
+
+        self.unfold_all_action = QAction("Unfold All", self)
+        self.unfold_all_action.triggered.connect(self.editor.unfold_all)
+        self.unfold_all_action.setStatusTip("Expand all collapsed regions")
+
+        # Compare
+        self.compare_file_action = QAction("Compare with File...", self)
+        self.compare_file_action.triggered.connect(self._on_compare_file)
+        self.compare_file_action.setStatusTip("Show differences between this document and another file")
+
+        self.compare_saved_action = QAction("Compare with Saved", self)
+        self.compare_saved_action.triggered.connect(self._on_compare_saved)
+        self.compare_saved_action.setStatusTip("Show unsaved changes against the file on disk")
+
+        # Undo memory limit
+        self.undo_limit_action = QAction("Undo Memory Limit...", self)
+        self.undo_limit_action.triggered.connect(self._on_undo_limit)
+        self.undo_limit_action.setStatusTip("Set how much memory the undo history may use")
+
+        # Assistant panel: the dock's own toggle action keeps the button in sync
+        self.agent_action = self.agent_dock.toggleViewAction()
+        self.agent_action.setText("Agent")
+        self.agent_action.toggled.connect(self._on_agent_toggled)
+        self.agent_action.setStatusTip("Show the assistant panel")
+        self.agent_action.setToolTip("Assistant")
+
         # Extra placeholder actions (icons only, no functionality yet)
-        self.agent_action = QAction("Agent", self)
-        self.agent_action.setEnabled(False)
 
         self.key_action = QAction("Key", self)
         self.key_action.setEnabled(False)
@@ -361,7 +2293,7 @@ class TextEditor(QMainWindow):
         spacer.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
         toolbar.addWidget(spacer)
 
-        # Bottom-only icons (no functionality yet)
+        # Bottom icons (Agent opens the assistant panel; the others have no functionality yet)
         self.agent_action.setIcon(self._load_colored_svg_icon("agent"))
         self.key_action.setIcon(self._load_colored_svg_icon("key"))
         self.settings_action.setIcon(self._load_colored_svg_icon("settings"))
@@ -375,20 +2307,15 @@ class TextEditor(QMainWindow):
         self.editor.copyAvailable.connect(self.copy_action.setEnabled)
         self.editor.copyAvailable.connect(self.cut_action.setEnabled)
 
-        # Document signals for undo/redo availability
-        doc = self.editor.document()
-        try:
-            doc.undoAvailable.connect(self.undo_action.setEnabled)
-            doc.redoAvailable.connect(self.redo_action.setEnabled)
-        except Exception:
-            # In case the API differs, fallback to checking availability manually
-            pass
+        # Undo history signals for undo/redo availability
+        history = self.editor.undo_history
+        history.undoAvailable.connect(self._update_undo_actions)
+        history.redoAvailable.connect(self._update_undo_actions)
 
         # Keep the UI in sync at startup
         self.copy_action.setEnabled(bool(self.editor.textCursor().hasSelection()))
         self.cut_action.setEnabled(bool(self.editor.textCursor().hasSelection()))
-        self.undo_action.setEnabled(doc.isUndoAvailable())
-        self.redo_action.setEnabled(doc.isRedoAvailable())
+        self._update_undo_actions()
 
     def create_menubar(self):
         """Create a proper menubar with File and Edit menus."""
@@ -421,12 +2348,27 @@ class TextEditor(QMainWindow):
         edit_menu.addAction(self.redo_action)
         edit_menu.addSeparator()
         edit_menu.addAction(self.repeat_action)
+        edit_menu.addAction(self.undo_limit_action)
+        edit_menu.addSeparator()
+        edit_menu.addAction(self.record_macro_action)
+        edit_menu.addAction(self.play_macro_action)
         edit_menu.addSeparator()
         # Add search and replace actions
         self.search_action.setIcon(self._load_icon("edit-find", QStyle.SP_FileDialogContentsView))
         self.replace_action.setIcon(self._load_icon("edit-find-replace", QStyle.SP_FileDialogContentsView))
         edit_menu.addAction(self.search_action)
         edit_menu.addAction(self.replace_action)
+        edit_menu.addSeparator()
+        edit_menu.addAction(self.spell_action)
+
+        # View menu
+        view_menu = menubar.addMenu("View")
+        view_menu.addAction(self.fold_action)
+        view_menu.addAction(self.unfold_action)
+        view_menu.addAction(self.unfold_all_action)
+        view_menu.addSeparator()
+        view_menu.addAction(self.compare_file_action)
+        view_menu.addAction(self.compare_saved_action)
 
     def create_statusbar(self):
         """Create status bar with line/column and word count indicators."""
@@ -434,7 +2376,9 @@ class TextEditor(QMainWindow):
         # Left part can show messages; we add two permanent widgets to the right
         self._status_word = QLabel("Words: 0")
         self._status_pos = QLabel("Ln 1, Col 1")
+        self._status_undo = QLabel("Undo: 0 B")
         # Slight padding
+        self._status_undo.setMargin(4)
         self._status_word.setMargin(4)
         self._status_pos.setMargin(8)
         # Use editor text color for status labels so they are visible in dark theme
@@ -442,18 +2386,22 @@ class TextEditor(QMainWindow):
             status_color = self.editor._get_editor_text_color().name()
         except Exception:
             status_color = "#ffffff"
+        self._status_undo.setStyleSheet(f"color: {status_color};")
         self._status_word.setStyleSheet(f"color: {status_color};")
         self._status_pos.setStyleSheet(f"color: {status_color};")
+        sb.addPermanentWidget(self._status_undo)
         sb.addPermanentWidget(self._status_word)
         sb.addPermanentWidget(self._status_pos)
 
         # Connect editor signals to update status
         self.editor.cursorPositionChanged.connect(self._update_cursor_position)
         self.editor.textChanged.connect(self._update_word_count)
+        self.editor.undo_history.usageChanged.connect(self._update_undo_usage)
 
         # Initialize values
         self._update_cursor_position()
         self._update_word_count()
+        self._update_undo_usage(self.editor.undo_history.memory_usage(), self.editor.undo_history.disk_usage())
 
     def _update_cursor_position(self):
         cursor = self.editor.textCursor()
@@ -463,22 +2411,61 @@ class TextEditor(QMainWindow):
         self._status_pos.setText(f"Ln {ln}, Col {col}")
 
     def _update_word_count(self):
+        if self._session_loader is not None or self.editor.is_folding():
+            # Counted once the session file has finished loading; folding changes no text
+            return
         text = self.editor.toPlainText()
         # count words using word boundaries
         words = re.findall(r"\b\w+\b", text)
         self._status_word.setText(f"Words: {len(words)}")
 
+    def _update_undo_usage(self, memory, disk):
+        text = f"Undo: {_format_bytes(memory)}"
+        if disk:
+            text += f" (+{_format_bytes(disk)} on disk)"
+        self._status_undo.setText(text)
+
+    def _on_toggle_spelling(self, checked):
+        if checked and self._spell_checker is None:
+            self._spell_checker = SpellChecker(self._word_list, self)
+            self._spell_checker.failed.connect(self._on_spelling_failed)
+        self.editor.set_spell_checker(self._spell_checker if checked else None)
+
+    def _on_spelling_failed(self, message):
+        self.spell_action.setChecked(False)
+        self.spell_action.setEnabled(False)
+        self.spell_action.setStatusTip("The word list could not be loaded")
+        self._spell_checker.deleteLater()
+        self._spell_checker = None
+        self.statusBar().showMessage(f"Spell checking unavailable: {message}", 5000)
+
+    def _on_undo_limit(self):
+        """Ask for a new undo memory budget in megabytes."""
+        history = self.editor.undo_history
+        current = max(1, history.memory_budget // (1024 * 1024))
+        value, ok = QInputDialog.getInt(self, "Undo Memory Limit", "Maximum undo memory (MB):", current, 1, 4096)
+        if ok:
+            history.set_memory_budget(value * 1024 * 1024)
+
     def _on_search(self):
         """Show the search widget in find-only mode and focus the input field."""
         self.search_widget.show_replace_controls(False)
         self.search_widget.show()
         self.search_widget.focus_input()
+        self._refresh_search()
     
     def _on_replace(self):
         """Show the search widget in find-and-replace mode and focus the input field."""
         self.search_widget.show_replace_controls(True)
         self.search_widget.show()
         self.search_widget.focus_input()
+        self._refresh_search()
+
+    def _refresh_search(self):
+        """Re-run a query left in the search box (e.g. restored from the session)."""
+        text = self.search_widget.get_search_text()
+        if text and not self.current_matches:
+            self._on_search_text_changed(text)
     
     def _on_search_text_changed(self, text):
         """Called when search text changes - find and highlight all matches."""
@@ -489,6 +2476,7 @@ class TextEditor(QMainWindow):
         
         # Find all matches
         self.current_matches = self._find_all_matches(text)
+        self._update_overview_matches()
         
         if self.current_matches:
             self.current_match_index = 0
@@ -514,6 +2502,21 @@ class TextEditor(QMainWindow):
         
         return matches
     
+    def _update_overview_matches(self):
+        """Send the block numbers of the current matches to the overview ruler."""
+        self.editor.set_overview_matches([cursor.blockNumber() for cursor in self.current_matches])
+
+    def _schedule_overview_refresh(self):
+        if self.current_matches:
+            self._overview_timer.start()
+
+    def _refresh_overview_matches(self):
+        if not self.current_matches:
+            return
+        self._update_overview_matches()
+        if self.current_match_index < len(self.current_matches):
+            self.editor.set_overview_current(self.current_matches[self.current_match_index].blockNumber())
+
     def _highlight_all_matches(self):
         """Highlight all matches with different colors for current vs other matches."""
         if not self.current_matches:
@@ -534,7 +2537,7 @@ class TextEditor(QMainWindow):
             
             extra_selections.append(selection)
         
-        self.editor.setExtraSelections(extra_selections)
+        self.editor.set_extra_selections("search", extra_selections)
     
     def _navigate_to_match(self, index):
         """Navigate to and select a specific match."""
@@ -544,6 +2547,7 @@ class TextEditor(QMainWindow):
         self.current_match_index = index
         cursor = self.current_matches[index]
         self.editor.setTextCursor(cursor)
+        self.editor.set_overview_current(cursor.blockNumber())
         self.editor.ensureCursorVisible()
         
         # Update highlighting to show new current match
@@ -557,6 +2561,7 @@ class TextEditor(QMainWindow):
         if not self.current_matches:
             return
         
+        self.editor.macro.record("find", self.search_widget.get_search_text(), False)
         next_index = (self.current_match_index + 1) % len(self.current_matches)
         self._navigate_to_match(next_index)
     
@@ -565,6 +2570,7 @@ class TextEditor(QMainWindow):
         if not self.current_matches:
             return
         
+        self.editor.macro.record("find", self.search_widget.get_search_text(), True)
         prev_index = (self.current_match_index - 1) % len(self.current_matches)
         self._navigate_to_match(prev_index)
     
@@ -572,6 +2578,8 @@ class TextEditor(QMainWindow):
         """Replace the current match and move to the next one."""
         if not self.current_matches or self.current_match_index >= len(self.current_matches):
             return
+        if self._edit_locked():
+            return
         
         search_text = self.search_widget.get_search_text()
         replace_text = self.search_widget.get_replace_text()
@@ -579,6 +2587,8 @@ class TextEditor(QMainWindow):
         if not search_text:
             return
         
+        self.editor.macro.record("replace", search_text, replace_text)
+
         # Get the current match cursor
         cursor = self.current_matches[self.current_match_index]
         
@@ -587,6 +2597,7 @@ class TextEditor(QMainWindow):
         
         # Refresh the matches list after replacement
         self.current_matches = self._find_all_matches(search_text)
+        self._update_overview_matches()
         
         if self.current_matches:
             # Stay at the same index (which is now the next match)
@@ -600,7 +2611,7 @@ class TextEditor(QMainWindow):
     
     def _replace_all(self):
         """Replace all matches at once."""
-        if not self.current_matches:
+        if not self.current_matches or self._edit_locked():
             return
         
         search_text = self.search_widget.get_search_text()
@@ -609,12 +2620,18 @@ class TextEditor(QMainWindow):
         if not search_text:
             return
         
+        self.editor.macro.record("replace_all", search_text, replace_text)
+
         # Count matches before replacing
         count = len(self.current_matches)
         
-        # Replace all matches from last to first to maintain cursor positions
+        # Replace all matches from last to first to maintain cursor positions.
+        # A single edit block makes this one undo entry.
+        edit_cursor = QTextCursor(self.editor.document())
+        edit_cursor.beginEditBlock()
         for cursor in reversed(self.current_matches):
             cursor.insertText(replace_text)
+        edit_cursor.endEditBlock()
         
         # Clear matches and highlights
         self.current_matches = []
@@ -635,7 +2652,8 @@ class TextEditor(QMainWindow):
     
     def _clear_search_highlights(self):
         """Clear all search highlights from the editor."""
-        self.editor.setExtraSelections([])
+        self.editor.set_extra_selections("search", [])
+        self.editor.set_overview_matches([])
     
     def eventFilter(self, obj, event):
         """Handle keyboard events in the search widget."""
@@ -649,6 +2667,13 @@ class TextEditor(QMainWindow):
                 else:
                     self._next_match()
                 return True
+
+        if obj == self.editor and event.type() == event.Type.ShortcutOverride:
+            # Leave these shortcuts unaccepted so the actions (chunked paste,
+            # macro recording) handle them instead of the editor's built-in copy/paste
+            if (event.matches(QKeySequence.Copy) or event.matches(QKeySequence.Cut)
+                    or event.matches(QKeySequence.Paste)):
+                return True
         
         return super().eventFilter(obj, event)
 
@@ -656,16 +2681,42 @@ class TextEditor(QMainWindow):
     # --- Edit action handlers (TextEditor forwards to the editor widget) ---
     def _on_copy(self):
         self.editor.copy()
+        self.editor.macro.record("copy")
         self._last_edit_action = "copy"
 
     def _on_paste(self):
-        self.editor.paste()
+        self._paste_text(self._clipboard_text())
         self._last_edit_action = "paste"
 
     def _on_cut(self):
+        if self._edit_locked():
+            return
         self.editor.cut()
+        self.editor.macro.record("cut")
         self._last_edit_action = "cut"
 
+    def _edit_locked(self):
+        """Return True while a paste, streamed reply or session load is writing to the document."""
+        return (self._paste_job is not None or self._agent_request is not None
+                or self._session_loader is not None)
+
+    def _refuse_while_writing(self):
+        """Return True, with a status message, while a paste or streamed reply is writing to the document.
+
+        Replacing the document then would leave their cursors at the start of
+        the new one, still inserting. (A session load is simply cancelled instead.)
+        """
+        if self._paste_job is None and self._agent_request is None:
+            return False
+        self.statusBar().showMessage("Wait for the paste or reply to finish, or stop it first", 3000)
+        return True
+
+    def _update_undo_actions(self):
+        history = self.editor.undo_history
+        locked = self._edit_locked()
+        self.undo_action.setEnabled(history.can_undo() and not locked)
+        self.redo_action.setEnabled(history.can_redo() and not locked)
+
     def _on_undo(self):
         self.editor.undo()
         self._last_edit_action = "undo"
@@ -676,26 +2727,187 @@ class TextEditor(QMainWindow):
 
     def _on_repeat(self):
         action = self._last_edit_action
-        if not action:
+        if not action or (action != "copy" and self._edit_locked()):
             return
         if action == "copy":
             self.editor.copy()
         elif action == "paste":
-            self.editor.paste()
+            self._paste_text(self._clipboard_text())
         elif action == "cut":
             self.editor.cut()
         elif action == "undo":
             self.editor.undo()
         elif action == "redo":
             self.editor.redo()
+        elif action == "macro":
+            self._play_macro(1)
+
+    def _on_record_macro(self, checked):
+        macro = self.editor.macro
+        if checked:
+            macro.start()
+            self.statusBar().showMessage("Recording macro...")
+        else:
+            macro.stop()
+            self.statusBar().showMessage(f"Recorded macro with {len(macro.steps)} step(s)", 3000)
+        self.play_macro_action.setEnabled(macro.has_macro())
+
+    def _on_play_macro(self):
+        """Ask how many times to run the macro (0 runs it until the end of the document)."""
+        times, ok = QInputDialog.getInt(self, "Play Macro", "Run how many times (0 = until end of document):",
+                                        1, 0, 10_000_000)
+        if ok:
+            self._play_macro(times)
+
+    def _play_macro(self, times):
+        if not self.editor.macro.has_macro() or self._edit_locked():
+            return
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            runs = self.editor.macro.play(self.editor, times)
+        finally:
+            QApplication.restoreOverrideCursor()
+        self.statusBar().showMessage(f"Macro ran {runs} time(s)", 3000)
+        self._last_edit_action = "macro"
+
+    def _on_clipboard_changed(self):
+        self._paste_buffer = None
+
+    def _clipboard_text(self):
+        """Return the clipboard text with line endings normalized, cached until the clipboard changes."""
+        if self._paste_buffer is None:
+            self._paste_buffer = _normalize_newlines(QApplication.clipboard().text())
+        return self._paste_buffer
+
+    def _paste_text(self, text):
+        """Insert text at the cursor, in chunks with a progress dialog if it is large."""
+        if not text or self._edit_locked():
+            return
+        self.editor.macro.record("insert", text)
+        if len(text) < PASTE_CHUNK_THRESHOLD:
+            self.editor.insertPlainText(text)
+            self.editor.ensureCursorVisible()
+            return
+
+        self._paste_job = ChunkedPaste(self.editor, text, self)
+        progress = QProgressDialog("Pasting...", "Cancel", 0, len(text), self)
+        progress.setWindowTitle("Paste")
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setMinimumDuration(300)
+        progress.canceled.connect(self._paste_job.cancel)
+        self._paste_job.progress.connect(progress.setValue)
+
+        def finished(completed):
+            progress.reset()
+            progress.deleteLater()
+            self._paste_job.deleteLater()
+            self._paste_job = None
+            self._update_undo_actions()
+            if not completed:
+                self.statusBar().showMessage("Paste cancelled", 3000)
+
+        self._paste_job.finished.connect(finished)
+        self._paste_job.start()
+        self._update_undo_actions()
+
+    # --- Assistant ---
+    def _on_agent_toggled(self, checked):
+        if checked:
+            self.agent_panel.prompt_input.setFocus()
+
+    def _agent_context(self):
+        """Return (before, selection, after): a bounded window of text around the cursor."""
+        document = self.editor.document()
+        cursor = self.editor.textCursor()
+        start, end = cursor.selectionStart(), cursor.selectionEnd()
+        doc_end = document.characterCount() - 1
+
+        def text_between(a, b):
+            window = QTextCursor(document)
+            window.setPosition(a)
+            window.setPosition(b, QTextCursor.KeepAnchor)
+            return window.selectedText().replace("\u2029", "\n")
+
+        if end - start <= AGENT_CONTEXT_SELECTION:
+            selection = text_between(start, end)
+        else:
+            half = AGENT_CONTEXT_SELECTION // 2
+            selection = text_between(start, start + half) + "\n[...]\n" + text_between(end - half, end)
+        return (text_between(max(0, start - AGENT_CONTEXT_BEFORE), start),
+                selection,
+                text_between(end, min(doc_end, end + AGENT_CONTEXT_AFTER)))
+
+    def _on_agent_send(self):
+        instruction = self.agent_panel.get_prompt().strip()
+        if not instruction or self._agent_request is not None or self.editor.isReadOnly():
+            return
+        prompt = build_agent_prompt(instruction, *self._agent_context())
+
+        self._agent_inserter = TokenInserter(self.editor, self)
+        self._agent_request = AgentRequest(self.agent_panel.get_backend(), prompt)
+        self._agent_request.token.connect(self._agent_inserter.add)
+        self._agent_request.finished.connect(self._on_agent_finished)
+        self.agent_panel.set_busy(True)
+        self.agent_panel.status_label.setText("Generating...")
+        self._agent_inserter.start()
+        self._agent_request.start()
+        self._update_undo_actions()
+
+    def _on_agent_stop(self):
+        if self._agent_request is not None:
+            self._agent_request.cancel()
+
+    def _on_agent_finished(self, error):
+        self._agent_inserter.finish()
+        self._agent_inserter.deleteLater()
+        self._agent_inserter = None
+        self._agent_request = None
+        self._update_undo_actions()
+        self.agent_panel.set_busy(False)
+        self.agent_panel.status_label.setText(error or "Done")
+        if not error:
+            self.agent_panel.prompt_input.clear()
+
+    # --- Compare ---
+    def _on_compare_file(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Compare with File", "", "Text Files (*.txt);;All Files (*)")
+        if path:
+            self._compare_with(path)
+
+    def _on_compare_saved(self):
+        if not self.current_file:
+            self.statusBar().showMessage("The document has not been saved yet", 3000)
+            return
+        self._compare_with(self.current_file)
+
+    def _compare_with(self, path):
+        try:
+            with open(path, "rb") as file:
+                other_lines = _decode_text(file.read()).split("\n")
+        except (OSError, UnicodeDecodeError) as e:
+            QMessageBox.critical(self, "Error", str(e))
+            return
+        if self.current_file:
+            title = os.path.basename(self.current_file)
+        else:
+            title = f"Untitled {self.untitled_count}"
+        window = CompareWindow(f"{title} (editor)", self.editor.toPlainText().split("\n"),
+                               os.path.basename(path), other_lines, self.editor, self)
+        window.setAttribute(Qt.WA_DeleteOnClose)
+        window.show()
 
     # --- File operations ---
     def open_file(self):
+        if self._refuse_while_writing():
+            return
         path, _ = QFileDialog.getOpenFileName(self, "Open File", "", "Text Files (*.txt)")
         if path:
+            self._cancel_session_load()
             try:
                 with open(path, "r", encoding="utf-8") as file:
                     self.editor.setPlainText(file.read())
+                    stat = os.fstat(file.fileno())
+                self._file_stat = (stat.st_mtime_ns, stat.st_size)
                 self.current_file = path
                 self.update_window_title()
             except Exception as e:
@@ -711,6 +2923,9 @@ class TextEditor(QMainWindow):
         try:
             with open(self.current_file, "w", encoding="utf-8") as file:
                 file.write(self.editor.toPlainText())
+            stat = os.stat(self.current_file)
+            self._file_stat = (stat.st_mtime_ns, stat.st_size)
+            self.editor.reset_modified_lines()
             self.update_window_title()
         except Exception as e:
             QMessageBox.critical(self, "Error", str(e))
@@ -724,14 +2939,22 @@ class TextEditor(QMainWindow):
         self.update_window_title()
 
     def close_file(self):
+        if self._refuse_while_writing():
+            return
+        self._cancel_session_load()
         self.editor.clear()
         self.current_file = None
+        self._file_stat = None
         self.untitled_count += 1
         self.update_window_title()
 
     def new_file(self):
+        if self._refuse_while_writing():
+            return
+        self._cancel_session_load()
         self.editor.clear()
         self.current_file = None
+        self._file_stat = None
         self.untitled_count += 1
         self.update_window_title()
 
@@ -745,6 +2968,177 @@ class TextEditor(QMainWindow):
         
         self.setWindowTitle(f"{doc_name} - My Modern Text Editor")
 
+    # --- Session ---
+    def closeEvent(self, event):
+        try:
+            self.save_session()
+        except OSError:
+            pass
+        if self._spell_checker is not None:
+            self._spell_checker.shutdown()
+        super().closeEvent(event)
+
+    def _encoded_offsets(self, first, last):
+        """Return the utf-8 offsets of blocks first..last and the document's size, as saved to disk.
+
+        Summed block by block so the document is never copied as a whole.
+        """
+        first_number, last_number = first.blockNumber(), last.blockNumber()
+        start = end = size = 0
+        number = 0
+        block = self.editor.document().begin()
+        while block.isValid():
+            if number == first_number:
+                start = size
+            text = block.text()
+            size += (len(text) if text.isascii() else len(text.encode("utf-8", "surrogatepass"))) + 1
+            if number == last_number:
+                end = size
+            block = block.next()
+            number += 1
+        size -= 1  # no line break after the last block
+        return start, min(end, size), size
+
+    def save_session(self):
+        """Save the open file, cursor, scroll position, search query and window geometry."""
+        editor = self.editor
+        cursor = editor.textCursor()
+        state = {
+            "geometry": bytes(self.saveGeometry().data()),
+            "path": self.current_file or "",
+            "search": self.search_widget.get_search_text(),
+            "mtime_ns": 0, "size": 0,
+            "anchor": cursor.anchor(), "position": cursor.position(),
+            "visible_start": -1, "visible_end": -1,
+            "first_block": editor.firstVisibleBlock().blockNumber(),
+        }
+        if self.current_file and self._file_stat and self._session_loader is None:
+            state["mtime_ns"], state["size"] = self._file_stat
+            # The visible region's byte offsets are only meaningful if the document
+            # still matches the file byte for byte
+            try:
+                unchanged = (os.stat(self.current_file).st_mtime_ns == self._file_stat[0]
+                             and not editor.has_modified_lines())
+            except OSError:
+                unchanged = False
+            if unchanged:
+                first = editor.firstVisibleBlock()
+                last = first
+                block = first
+                top = editor.blockBoundingGeometry(block).translated(editor.contentOffset()).top()
+                bottom = editor.viewport().rect().bottom()
+                while block.isValid() and top <= bottom:
+                    last = block
+                    top += editor.blockBoundingRect(block).height()
+                    block = block.next()
+                visible_start, visible_end, size = self._encoded_offsets(first, last)
+                if size == self._file_stat[1]:
+                    state["visible_start"], state["visible_end"] = visible_start, visible_end
+        write_session(SESSION_PATH, state)
+
+    def restore_session(self):
+        """Restore the window geometry and search query, then start loading the last file."""
+        state = read_session(SESSION_PATH)
+        if state is None:
+            return
+        if state["geometry"]:
+            self.restoreGeometry(QByteArray(state["geometry"]))
+        if state["search"]:
+            # Prefilled without searching; the search runs when the search bar is opened
+            self.search_widget.search_input.blockSignals(True)
+            self.search_widget.search_input.setText(state["search"])
+            self.search_widget.search_input.blockSignals(False)
+        if state["path"] and os.path.isfile(state["path"]):
+            QTimer.singleShot(0, lambda: self._restore_file(state))
+
+    def _restore_file(self, state):
+        path = state["path"]
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+                stat = os.fstat(file.fileno())
+        except OSError:
+            return
+        self.current_file = path
+        self._file_stat = (stat.st_mtime_ns, stat.st_size)
+        self.update_window_title()
+
+        visible_start, visible_end = state["visible_start"], state["visible_end"]
+        if ((stat.st_mtime_ns, stat.st_size) == (state["mtime_ns"], state["size"])
+                and 0 <= visible_start <= visible_end <= len(data)):
+            # Unchanged since the session was saved: show the stored region first
+            self._session_loader = SessionFileLoader(self.editor, data, visible_start, visible_end, self)
+            self._session_loader.finished.connect(lambda: self._finish_restore(state))
+            self._session_loader.start()
+            self._update_undo_actions()
+            return
+
+        try:
+            self.editor.setPlainText(_decode_text(data))
+        except UnicodeDecodeError as e:
+            QMessageBox.critical(self, "Error", str(e))
+            self.current_file = None
+            self._file_stat = None
+            self.update_window_title()
+            return
+        self._finish_restore(state)
+
+    def _cancel_session_load(self):
+        loader = self._session_loader
+        if loader is not None:
+            self._session_loader = None
+            loader.finished.disconnect()
+            loader.cancel()
+            loader.deleteLater()
+            self._update_undo_actions()
+
+    def _finish_restore(self, state):
+        loader = self._session_loader
+        if loader is not None:
+            self._session_loader = None
+            loader.deleteLater()
+            self._update_undo_actions()
+            if loader.error is not None:
+                # Do not leave a partly loaded file open where it could be saved over the original
+                self.editor.clear()
+                self.current_file = None
+                self._file_stat = None
+                self.update_window_title()
+                self._update_word_count()
+                QMessageBox.critical(self, "Error", loader.error)
+                return
+        editor = self.editor
+        document = editor.document()
+        doc_end = document.characterCount() - 1
+        cursor = QTextCursor(document)
+        cursor.setPosition(min(state["anchor"], doc_end))
+        cursor.setPosition(min(state["position"], doc_end), QTextCursor.KeepAnchor)
+        editor.setTextCursor(cursor)
+        first = document.findBlockByNumber(min(state["first_block"], document.blockCount() - 1))
+        editor.verticalScrollBar().setValue(first.firstLineNumber())
+        self._update_word_count()
+
+
+class OverviewRuler(QWidget):
+    """Whole-document overview drawn between the text and the vertical scrollbar."""
+
+    def __init__(self, editor):
+        super().__init__(editor)
+        self._editor = editor
+
+    def sizeHint(self):
+        return QSize(OVERVIEW_RULER_WIDTH, 0)
+
+    def paintEvent(self, event):
+        self._editor.overviewRulerPaintEvent(event)
+
+    def mousePressEvent(self, event):
+        self._editor.overviewRulerClicked(event.position().y())
+
+    def mouseMoveEvent(self, event):
+        if event.buttons() & Qt.LeftButton:
+            self._editor.overviewRulerClicked(event.position().y())
+
 
 class LineNumberArea(QWidget):
     def __init__(self, editor):
@@ -757,32 +3151,179 @@ class LineNumberArea(QWidget):
     def paintEvent(self, event):
         self._editor.lineNumberAreaPaintEvent(event)
 
+    def mousePressEvent(self, event):
+        self._editor.lineNumberAreaMousePressEvent(event)
+
 
 from PySide6.QtGui import QPainter, QColor, QFont
 from PySide6.QtCore import QRect, QSize
 
 
+# Overview ruler
+OVERVIEW_RULER_WIDTH = 14
+OVERVIEW_MATCH_COLOR = "#FFD700"     # same gold as other search matches
+OVERVIEW_CURRENT_COLOR = "#FF8C00"   # same orange as the current match
+OVERVIEW_MODIFIED_COLOR = "#3A8FD9"
+
+
+# Code folding
+FOLD_TAB_WIDTH = 4
+FOLD_SCAN_LIMIT = 5000  # blocks searched for the end of a region before giving up
+# Brackets, and double-quoted strings whose brackets do not count (a JSON value "{"
+# must not open a region). Single quotes are left alone: they double as apostrophes.
+_BRACKET_RE = re.compile(r'"(?:[^"\\]|\\.)*"?|[{}\[\]()]')
+
+
+def _fold_metrics(text):
+    """Return (indent, net, low, opens) for a line of text.
+
+    `indent` is the indentation width (None for blank lines), `net` the change
+    in bracket depth over the line and `low` the lowest depth reached within it.
+    `opens` is True when the line ends with an opening bracket; only such lines
+    start a bracket region, so prose like "(see below" does not.
+    """
+    stripped = text.lstrip(" \t")
+    indent = len(text[:len(text) - len(stripped)].expandtabs(FOLD_TAB_WIDTH)) if stripped else None
+    depth = low = 0
+    last = None
+    for match in _BRACKET_RE.finditer(text):
+        last = match
+        if match.group()[0] == '"':
+            continue
+        if match.group() in "{[(":
+            depth += 1
+        else:
+            depth -= 1
+            low = min(low, depth)
+    opens = last is not None and last.group() in "{[(" and last.end() == len(text.rstrip())
+    return indent, depth, low, opens
+
+
+def _bucket_counts(sorted_lines, line_count, rows):
+    """Count how many of `sorted_lines` fall into each of `rows` equal slices of the document.
+
+    Uses one bisect per row boundary, so the cost depends on the number of rows
+    rather than the number of matches.
+    """
+    bounds = [bisect.bisect_left(sorted_lines, -(-r * line_count // rows)) for r in range(rows + 1)]
+    return [bounds[r + 1] - bounds[r] for r in range(rows)]
+
+
 class CodeEditor(QPlainTextEdit):
     def __init__(self, parent=None):
         super().__init__(parent)
 
         self.lineNumberArea = LineNumberArea(self)
+        self.overviewRuler = OverviewRuler(self)
+        # Overview ruler state: sorted block numbers of search matches, the current
+        # match's block, and modified lines as sorted (first, last) block ranges.
+        # The rendered pixmap is cached until the data or the ruler size changes.
+        self._overview_matches = []
+        self._overview_current = None
+        self._modified_ranges = []
+        self._block_count = self.blockCount()
+        self._overview_version = 0
+        self._overview_cache = None
+        self._overview_cache_key = None
+        # Bounded undo history replaces the document's own unlimited undo stack
+        self.undo_history = UndoHistory(self)
+        self.macro = MacroRecorder()
+        # Called with the text of context-menu pastes and drops (see insertFromMimeData)
+        self.paste_handler = None
+
+        # Extra selections are kept in layers so spelling underlines and search
+        # highlights can be updated independently; later layers draw on top.
+        # The current line is intentionally not highlighted (low contrast on dark themes).
+        self._extra_selection_layers = {"spelling": [], "search": []}
+        self._spell_checker = None
+        self._spell_timer = QTimer(self)
+        self._spell_timer.setSingleShot(True)
+        self._spell_timer.setInterval(150)
+        self._spell_timer.timeout.connect(self._refresh_spelling)
+
+        # Folding: cached _fold_metrics per block number (None until needed, and
+        # reset for blocks touched by an edit) and the collapsed regions as
+        # {header block: last hidden block}
+        self._fold_metrics_cache = [None] * self.blockCount()
+        self._folds = {}
+        self._folding = False  # set while markContentsDirty relayouts folded blocks
 
         self.blockCountChanged.connect(self.updateLineNumberAreaWidth)
         self.updateRequest.connect(self.updateLineNumberArea)
-        self.cursorPositionChanged.connect(self.highlightCurrentLine)
+        self.cursorPositionChanged.connect(self._reveal_cursor)
+        self.document().contentsChange.connect(self._on_contents_change)
+        self.verticalScrollBar().valueChanged.connect(lambda _: self.overviewRuler.update())
 
         self.updateLineNumberAreaWidth(0)
-        self.highlightCurrentLine()
+
+    def undo(self):
+        # A chunked paste, streamed reply or session load owns the document while it is read-only
+        if not self.isReadOnly():
+            self.undo_history.undo()
+
+    def redo(self):
+        if not self.isReadOnly():
+            self.undo_history.redo()
+
+    def setPlainText(self, text):
+        """Replace the document text and start a fresh undo history."""
+        with self.undo_history.suspended():
+            super().setPlainText(text)
+        self.undo_history.reset(text)
+        self.reset_modified_lines()
+        self._reset_folding()
+
+    def clear(self):
+        with self.undo_history.suspended():
+            super().clear()
+        self.undo_history.reset()
+        self.reset_modified_lines()
+        self._reset_folding()
+
+    def keyPressEvent(self, event):
+        # The built-in Undo/Redo key handling talks to the document's disabled stack
+        if event.matches(QKeySequence.Undo):
+            self.undo()
+            return
+        if event.matches(QKeySequence.Redo):
+            self.redo()
+            return
+        if not self.isReadOnly():
+            page_lines = max(1, self.viewport().height() // self.fontMetrics().lineSpacing())
+            self.macro.record_key(event, page_lines)
+        super().keyPressEvent(event)
+
+    def contextMenuEvent(self, event):
+        # The standard menu's Undo/Redo talk to the document's disabled stack
+        menu = self.createStandardContextMenu(event.pos())
+        for action in menu.actions():
+            if action.objectName() in ("edit-undo", "edit-redo"):
+                undo = action.objectName() == "edit-undo"
+                action.triggered.disconnect()
+                action.triggered.connect(self.undo if undo else self.redo)
+                available = self.undo_history.can_undo() if undo else self.undo_history.can_redo()
+                action.setEnabled(available and not self.isReadOnly())
+        menu.exec(event.globalPos())
+        menu.deleteLater()
+
+    def insertFromMimeData(self, source):
+        # Context-menu Paste and drag-and-drop end up here rather than in the Paste action
+        if self.paste_handler is not None and source.hasText():
+            self.paste_handler(_normalize_newlines(source.text()))
+            return
+        super().insertFromMimeData(source)
 
     def lineNumberAreaWidth(self):
         # Calculate space needed for line numbers
         digits = len(str(max(1, self.blockCount())))
-        space = self.fontMetrics().horizontalAdvance('9') * digits + 12
+        space = self.fontMetrics().horizontalAdvance('9') * digits + 12 + self.foldMarkerWidth()
         return space
 
+    def foldMarkerWidth(self):
+        return self.fontMetrics().height()
+
     def updateLineNumberAreaWidth(self, _):
-        self.setViewportMargins(self.lineNumberAreaWidth(), 0, 0, 0)
+        self.setViewportMargins(self.lineNumberAreaWidth(), 0, OVERVIEW_RULER_WIDTH, 0)
 
     def _get_editor_background_color(self):
         ss = QApplication.instance().styleSheet() or ""
@@ -818,12 +3359,85 @@ class CodeEditor(QPlainTextEdit):
 
         cr = self.contentsRect()
         self.lineNumberArea.setGeometry(QRect(cr.left(), cr.top(), self.lineNumberAreaWidth(), cr.height()))
+        # The ruler sits in the right viewport margin, just left of the scrollbar
+        vp = self.viewport().geometry()
+        self.overviewRuler.setGeometry(QRect(vp.right() + 1, vp.top(), OVERVIEW_RULER_WIDTH, vp.height()))
+
+    def set_extra_selections(self, layer, selections):
+        """Replace one layer ("spelling" or "search") of extra selections."""
+        if not selections and not self._extra_selection_layers[layer]:
+            return
+        self._extra_selection_layers[layer] = selections
+        self.setExtraSelections([selection for layer_selections in self._extra_selection_layers.values()
+                                 for selection in layer_selections])
+
+    # --- Spell checking ---
+    def set_spell_checker(self, checker):
+        """Enable spell checking with a SpellChecker, or disable it with None."""
+        if self._spell_checker is not None:
+            self._spell_checker.checked.disconnect(self._spell_timer.start)
+            self._spell_checker.cancel_pending()
+            self.textChanged.disconnect(self._spell_timer.start)
+            self.verticalScrollBar().valueChanged.disconnect(self._spell_timer.start)
+        self._spell_checker = checker
+        if checker is not None:
+            checker.checked.connect(self._spell_timer.start)
+            self.textChanged.connect(self._spell_timer.start)
+            self.verticalScrollBar().valueChanged.connect(self._spell_timer.start)
+            self._spell_timer.start()
+        else:
+            self.set_extra_selections("spelling", [])
+
+    def _refresh_spelling(self):
+        """Underline misspellings in the visible blocks, requesting checks for unchecked ones."""
+        checker = self._spell_checker
+        if checker is None:
+            return
+        # Anything still queued from an earlier viewport is no longer urgent
+        checker.cancel_pending()
+
+        fmt = QTextCharFormat()
+        fmt.setUnderlineStyle(QTextCharFormat.SpellCheckUnderline)
+        fmt.setUnderlineColor(QColor(SPELL_UNDERLINE_COLOR))
+        spans = []
+
+        block = self.firstVisibleBlock()
+        top = self.blockBoundingGeometry(block).translated(self.contentOffset()).top()
+        bottom = self.viewport().rect().bottom()
+        while block.isValid() and top <= bottom:
+            if block.isVisible():
+                text = block.text()
+                block_spans = checker.misspellings(text)
+                if block_spans is None:
+                    checker.request(text, 0)
+                else:
+                    spans.extend((block.position() + start, length) for start, length in block_spans)
+            top += self.blockBoundingRect(block).height()
+            block = block.next()
 
-    def highlightCurrentLine(self):
-        # Removing the yellow highlight to avoid low-contrast issues with dark themes.
-        # We intentionally do not set any extra selections here so the current line
-        # remains unhighlighted and text visibility is preserved.
-        self.setExtraSelections([])
+        # Check the blocks just below the viewport at lower priority so scrolling shows results sooner
+        for _ in range(SPELL_PREFETCH_BLOCKS):
+            if not block.isValid():
+                break
+            if checker.misspellings(block.text()) is None:
+                checker.request(block.text(), 1)
+            block = block.next()
+
+        # The shown underlines' cursors follow edits, so scrolling and typing
+        # elsewhere usually leave nothing to update
+        shown = [(selection.cursor.selectionStart(), selection.cursor.selectionEnd() - selection.cursor.selectionStart())
+                 for selection in self._extra_selection_layers["spelling"]]
+        if spans == shown:
+            return
+        selections = []
+        for position, length in spans:
+            selection = QTextEdit.ExtraSelection()
+            selection.cursor = QTextCursor(self.document())
+            selection.cursor.setPosition(position)
+            selection.cursor.setPosition(position + length, QTextCursor.KeepAnchor)
+            selection.format = fmt
+            selections.append(selection)
+        self.set_extra_selections("spelling", selections)
 
     def lineNumberAreaPaintEvent(self, event):
         # Determine editor background and text color before creating the painter
@@ -841,13 +3455,20 @@ class CodeEditor(QPlainTextEdit):
         bottom = top + int(self.blockBoundingRect(block).height())
 
         height = self.fontMetrics().height()
+        marker_width = self.foldMarkerWidth()
+        marker_left = self.lineNumberArea.width() - marker_width
 
         while block.isValid() and top <= event.rect().bottom():
             if block.isVisible() and bottom >= event.rect().top():
                 number = str(blockNumber + 1)
                 # Use the editor's text color so numbers contrast correctly
                 painter.setPen(text_color)
-                painter.drawText(0, top, self.lineNumberArea.width() - 4, height, Qt.AlignRight, number)
+                painter.drawText(0, top, marker_left - 4, height, Qt.AlignRight, number)
+                # Fold markers: collapsed regions and foldable lines
+                if blockNumber in self._folds:
+                    painter.drawText(marker_left, top, marker_width, height, Qt.AlignCenter, "\u25b8")
+                elif self.is_fold_start(blockNumber):
+                    painter.drawText(marker_left, top, marker_width, height, Qt.AlignCenter, "\u25be")
 
             block = block.next()
             top = bottom
@@ -855,6 +3476,291 @@ class CodeEditor(QPlainTextEdit):
             blockNumber += 1
 
 
+    # --- Code folding ---
+    def is_folding(self):
+        """Return True while folding relayouts blocks; the text does not change then."""
+        return self._folding
+
+    def _reset_folding(self):
+        self._fold_metrics_cache = [None] * self.blockCount()
+        self._folds = {}
+
+    def _track_folds(self, first, last, old_last, delta):
+        """Invalidate metrics of edited blocks, shift folds after the edit and open folds it touched."""
+        self._fold_metrics_cache[first:old_last + 1] = [None] * (last - first + 1)
+        folds = {}
+        reopen = []
+        for start, end in self._folds.items():
+            if end < first:
+                folds[start] = end
+            elif start > old_last:
+                folds[start + delta] = end + delta
+            else:
+                reopen.append((min(start, first), max(end + delta, last)))
+        self._folds = folds
+        for start, end in reopen:
+            self._set_blocks_visible(start + 1, min(end, self.blockCount() - 1), True)
+
+    def _block_metrics(self, number):
+        metrics = self._fold_metrics_cache[number]
+        if metrics is None:
+            metrics = _fold_metrics(self.document().findBlockByNumber(number).text())
+            self._fold_metrics_cache[number] = metrics
+        return metrics
+
+    def _next_indent(self, number):
+        """Return (block number, indent) of the next non-blank block after `number`, or (None, None)."""
+        for candidate in range(number + 1, min(self.blockCount(), number + 1 + FOLD_SCAN_LIMIT)):
+            indent = self._block_metrics(candidate)[0]
+            if indent is not None:
+                return candidate, indent
+        return None, None
+
+    def is_fold_start(self, number):
+        """Cheap test used for gutter markers: does a region start at this block?"""
+        indent, _, _, opens = self._block_metrics(number)
+        if opens:
+            return True
+        if indent is None:
+            return False
+        _, next_indent = self._next_indent(number)
+        return next_indent is not None and next_indent > indent
+
+    def fold_region(self, number):
+        """Return the last block of the region starting at `number`, or None.
+
+        A line ending with an opening bracket folds up to the line before the
+        one that closes it (if that is within FOLD_SCAN_LIMIT lines); otherwise
+        the region is the following lines that are indented deeper than this one.
+        """
+        count = self.blockCount()
+        indent, net, low, opens = self._block_metrics(number)
+        if opens:
+            depth = net - low
+            for candidate in range(number + 1, min(count, number + 1 + FOLD_SCAN_LIMIT)):
+                _, block_net, block_low, _ = self._block_metrics(candidate)
+                if depth + block_low <= 0:
+                    return candidate - 1 if candidate - 1 > number else None
+                depth += block_net
+            return count - 1 if count - 1 - number <= FOLD_SCAN_LIMIT else None
+        if indent is None:
+            return None
+        end = None
+        candidate, next_indent = self._next_indent(number)
+        while candidate is not None and next_indent > indent:
+            end = candidate
+            candidate, next_indent = self._next_indent(candidate)
+        return end
+
+    def fold(self, number):
+        end = self.fold_region(number)
+        if end is None or number in self._folds:
+            return
+        self._folds[number] = end
+        self._set_blocks_visible(number + 1, end, False)
+        # Keep the cursor out of the hidden blocks
+        cursor = self.textCursor()
+        if number < cursor.blockNumber() <= end:
+            header = self.document().findBlockByNumber(number)
+            cursor.setPosition(header.position() + header.length() - 1)
+            self.setTextCursor(cursor)
+
+    def unfold(self, number):
+        end = self._folds.pop(number, None)
+        if end is None:
+            return
+        self._set_blocks_visible(number + 1, end, True)
+        # Nested regions that were folded before stay folded
+        for start, inner_end in list(self._folds.items()):
+            if number < start <= end:
+                self._set_blocks_visible(start + 1, inner_end, False)
+
+    def toggle_fold(self, number):
+        if number in self._folds:
+            self.unfold(number)
+        else:
+            self.fold(number)
+
+    def unfold_all(self):
+        for start in sorted(self._folds):
+            self.unfold(start)
+
+    def fold_at_cursor(self):
+        """Fold the innermost region containing the cursor line."""
+        number = self.textCursor().blockNumber()
+        for start in range(number, -1, -1):
+            if start not in self._folds and self.is_fold_start(start):
+                end = self.fold_region(start)
+                if end is not None and (start == number or end >= number):
+                    self.fold(start)
+                    return
+
+    def unfold_at_cursor(self):
+        number = self.textCursor().blockNumber()
+        if number in self._folds:
+            self.unfold(number)
+
+    def _reveal_cursor(self):
+        """Unfold regions hiding the cursor (e.g. after jumping to a search match)."""
+        block = self.textCursor().block()
+        if block.isVisible():
+            return
+        number = block.blockNumber()
+        for start, end in sorted(self._folds.items()):
+            if start < number <= end:
+                self.unfold(start)
+
+    def _set_blocks_visible(self, first, last, visible):
+        if first > last:
+            return
+        doc = self.document()
+        block = doc.findBlockByNumber(first)
+        start = block.position()
+        while block.isValid() and block.blockNumber() <= last:
+            block.setVisible(visible)
+            end = block.position() + block.length()
+            block = block.next()
+        # Relayout the changed blocks; hidden blocks take no lines in the layout.
+        # This emits contentsChange without changing text, so edit tracking is paused.
+        self._folding = True
+        try:
+            with self.undo_history.suspended():
+                doc.markContentsDirty(start, min(end, doc.characterCount()) - start)
+        finally:
+            self._folding = False
+        self.viewport().update()
+        self.lineNumberArea.update()
+
+    def lineNumberAreaMousePressEvent(self, event):
+        """Toggle a fold when its marker in the gutter is clicked."""
+        marker_left = self.lineNumberArea.width() - self.foldMarkerWidth()
+        if event.position().x() < marker_left:
+            return
+        y = event.position().y()
+        block = self.firstVisibleBlock()
+        top = self.blockBoundingGeometry(block).translated(self.contentOffset()).top()
+        while block.isValid() and top <= y:
+            bottom = top + self.blockBoundingRect(block).height()
+            if block.isVisible() and y < bottom:
+                if block.blockNumber() in self._folds or self.is_fold_start(block.blockNumber()):
+                    self.toggle_fold(block.blockNumber())
+                return
+            top = bottom
+            block = block.next()
+
+    # --- Overview ruler ---
+    def set_overview_matches(self, lines):
+        """Set the sorted block numbers of search matches shown on the overview ruler."""
+        self._overview_matches = lines
+        self._overview_current = None
+        self._overview_version += 1
+        self.overviewRuler.update()
+
+    def set_overview_current(self, line):
+        self._overview_current = line
+        self.overviewRuler.update()
+
+    def has_modified_lines(self):
+        return bool(self._modified_ranges)
+
+    def reset_modified_lines(self):
+        """Forget modified-line markers (after loading or saving a file)."""
+        self._modified_ranges = []
+        self._block_count = self.blockCount()
+        self._overview_version += 1
+        self.overviewRuler.update()
+
+    def _on_contents_change(self, position, removed, added):
+        if self._folding or (not removed and not added):
+            return
+        doc = self.document()
+        count = doc.blockCount()
+        delta = count - self._block_count
+        self._block_count = count
+        # Blocks first..last now cover the edit; they were first..old_last before it
+        first = doc.findBlock(position).blockNumber()
+        last = doc.findBlock(min(position + added, doc.characterCount() - 1)).blockNumber()
+        old_last = last - delta
+        self._track_modified_lines(first, last, old_last, delta)
+        self._track_folds(first, last, old_last, delta)
+
+    def _track_modified_lines(self, first, last, old_last, delta):
+        # Keep ranges before the edit, mark the edited blocks, and shift the ranges after it
+        ranges = [(start, min(end, first - 1)) for start, end in self._modified_ranges if start < first]
+        ranges.append((first, last))
+        ranges += [(max(start, old_last + 1) + delta, end + delta)
+                   for start, end in self._modified_ranges if end > old_last]
+        merged = []
+        for start, end in ranges:
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        self._modified_ranges = merged
+        self._overview_version += 1
+        self.overviewRuler.update()
+
+    def _render_overview(self, width, height):
+        """Render match density and modified lines into a pixmap."""
+        pix = QPixmap(width, height)
+        pix.fill(self._get_editor_background_color())
+        painter = QPainter(pix)
+        lines = max(1, self.blockCount())
+        # Each line gets at least its share of pixels so short documents stay readable
+        line_height = max(2, height // lines)
+
+        for start, end in self._modified_ranges:
+            top = start * height // lines
+            bottom = max(top + line_height, (end + 1) * height // lines)
+            painter.fillRect(0, top, 3, bottom - top, QColor(OVERVIEW_MODIFIED_COLOR))
+
+        counts = _bucket_counts(self._overview_matches, lines, height)
+        peak = max(counts, default=0)
+        if peak:
+            color = QColor(OVERVIEW_MATCH_COLOR)
+            for row, count in enumerate(counts):
+                if count:
+                    # Square-root scaling keeps single hits visible next to dense clusters
+                    color.setAlpha(90 + int(165 * math.sqrt(count / peak)))
+                    painter.fillRect(4, row, width - 4, line_height, color)
+        painter.end()
+        return pix
+
+    def overviewRulerPaintEvent(self, event):
+        ruler = self.overviewRuler
+        width, height = ruler.width(), ruler.height()
+        if width <= 0 or height <= 0:
+            return
+        key = (width, height, self._overview_version)
+        if self._overview_cache_key != key:
+            self._overview_cache = self._render_overview(width, height)
+            self._overview_cache_key = key
+
+        painter = QPainter(ruler)
+        painter.drawPixmap(0, 0, self._overview_cache)
+        lines = max(1, self.blockCount())
+
+        # Visible region
+        first = self.firstVisibleBlock().blockNumber()
+        visible = max(1, self.viewport().height() // max(1, self.fontMetrics().height()))
+        top = first * height // lines
+        bottom = max(top + 2, (first + visible) * height // lines)
+        painter.fillRect(0, top, width, bottom - top, QColor(255, 255, 255, 40))
+
+        # Current match
+        if self._overview_current is not None:
+            y = self._overview_current * height // lines
+            painter.fillRect(0, y - 1, width, 3, QColor(OVERVIEW_CURRENT_COLOR))
+        painter.end()
+
+    def overviewRulerClicked(self, y):
+        """Jump to the line under the given ruler y coordinate."""
+        lines = self.blockCount()
+        number = int(y * lines / max(1, self.overviewRuler.height()))
+        block = self.document().findBlockByNumber(min(lines - 1, max(0, number)))
+        self.setTextCursor(QTextCursor(block))
+        self.centerCursor()
+
     # Note: file operation methods (open/save/close/new) and edit action handlers
     # are implemented on the TextEditor container and forward to this widget.
 